@@ -0,0 +1,650 @@
+#!/usr/bin/env python3
+
+# Copyright © io mintz <io@mintz.cc>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”),
+# to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Benchmarks for import_expression.
+
+Run ./bench.py to run all of them, or ./bench.py NAME... to run some of them.
+Pass --json FILE to save the results, and --compare FILE to compare them against results saved earlier,
+e.g. from another revision.
+"""
+
+import argparse
+import ast
+import contextlib
+import datetime
+import importlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import warnings
+
+import import_expression as ie
+
+benchmarks = {}
+
+def benchmark(func):
+	benchmarks[func.__name__] = func
+	return func
+
+def best_of(func, *, repeat=5, number=None):
+	"""return the shortest time in seconds that one call to func took"""
+	timer = timeit.Timer(func)
+	if number is None:
+		# calls long enough to time on their own don't need to be looped, and looping them takes a while
+		number = 1 if timer.timeit(number=1) >= 0.05 else timer.autorange()[0]
+	return min(timer.repeat(repeat=repeat, number=number)) / number
+
+@contextlib.contextmanager
+def temp_dir():
+	path = tempfile.mkdtemp(prefix='import_expression_bench_')
+	try:
+		yield path
+	finally:
+		shutil.rmtree(path)
+
+def plain_module(n_functions):
+	return ''.join(
+		f'def f{i}(x, y=1):\n'
+		f'\t"""docstring {i}"""\n'
+		f'\tif x > y:\n'
+		f'\t\treturn [x * j for j in range(y)]\n'
+		f'\treturn {{"x": x, "y": (y, {i})}}\n\n'
+		for i in range(n_functions)
+	)
+
+@benchmark
+def import_hook(n_modules=200, repeat=5):
+	"""time importing a package of plain modules with and without the import hook"""
+	with temp_dir() as path, contextlib.ExitStack() as stack:
+		package = 'ie_bench_pkg'
+		package_path = os.path.join(path, package)
+		os.mkdir(package_path)
+		open(os.path.join(package_path, '__init__.py'), 'w').close()
+		for i in range(n_modules):
+			with open(os.path.join(package_path, f'mod{i}.py'), 'w') as f:
+				f.write(plain_module(20))
+
+		sys.path.insert(0, path)
+		stack.callback(sys.path.remove, path)
+		old_dont_write_bytecode = sys.dont_write_bytecode
+		sys.dont_write_bytecode = False
+		stack.callback(setattr, sys, 'dont_write_bytecode', old_dont_write_bytecode)
+
+		def import_all(*, cold):
+			for name in [name for name in sys.modules if name.partition('.')[0] == package]:
+				del sys.modules[name]
+			if cold:
+				shutil.rmtree(os.path.join(package_path, '__pycache__'), ignore_errors=True)
+			importlib.invalidate_caches()
+
+			start = time.perf_counter()
+			for i in range(n_modules):
+				importlib.import_module(f'{package}.mod{i}')
+			return time.perf_counter() - start
+
+		results = {}
+		for label, install_kwargs in (
+			('vanilla', None),
+			('package', dict(packages=[package])),
+			('marker', dict(marker=True)),
+		):
+			finder = ie.install(**install_kwargs) if install_kwargs is not None else None
+			try:
+				for cold in (True, False):
+					results[f'{label} {"cold" if cold else "warm"}'] = min(import_all(cold=cold) for _ in range(repeat))
+			finally:
+				if finder is not None:
+					ie.uninstall(finder)
+
+		return results
+
+def import_expressions_source(n, *, per_line=1):
+	lines = []
+	for i in range(0, n, per_line):
+		lines.append('x = ' + ' + '.join(f'a{j}.b!.c(d)' for j in range(i, min(n, i + per_line))))
+	return '\n'.join(lines) + '\n'
+
+@benchmark
+def transform_tokens():
+	"""time per import expression of transform_tokens, which should stay constant as the number of them grows"""
+	from import_expression import _syntax
+
+	results = {}
+	for layout, per_line in (('1 per line', 1), ('1 line', None)):
+		for n in (1, 100, 10_000):
+			tokens = list(_syntax.tokenize(import_expressions_source(n, per_line=per_line or n))[0])
+			results[f'{n} expressions, {layout}'] = best_of(lambda: _syntax.transform_tokens(tokens), repeat=3) / n
+	return results
+
+def stdlib_corpus(limit=None):
+	"""return the source of the pure Python modules at the top level of the standard library"""
+	import glob
+
+	sources = []
+	for path in sorted(glob.glob(os.path.join(os.path.dirname(os.__file__), '*.py')))[:limit]:
+		with open(path, 'rb') as f:
+			source = f.read()
+		try:
+			with warnings.catch_warnings():
+				warnings.simplefilter('ignore')
+				compile(source, path, 'exec')
+		except SyntaxError:
+			# e.g. lib2to3 test data
+			continue
+		sources.append((path, source))
+	return sources
+
+@benchmark
+def fast_path():
+	"""time compiling the standard library with and without skipping the transformation steps"""
+	corpus = stdlib_corpus()
+
+	def compile_all(compile):
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore')
+			for path, source in corpus:
+				compile(source, path)
+
+	return {
+		f'builtins.compile, {len(corpus)} files': best_of(
+			lambda: compile_all(lambda source, path: compile(source, path, 'exec')),
+			repeat=3,
+			number=1,
+		),
+		'fast path': best_of(
+			lambda: compile_all(lambda source, path: ie._compile(source, path, 'exec', 0, True, -1)),
+			repeat=3,
+			number=1,
+		),
+		'full pipeline': best_of(
+			lambda: compile_all(lambda source, path: ie._compile(source, path, 'exec', 0, True, -1, fast=False)),
+			repeat=3,
+			number=1,
+		),
+	}
+
+@benchmark
+def engines():
+	"""time compiling a module full of import expressions with each engine"""
+	source = import_expressions_source(1000, per_line=5)
+	return {
+		f'{engine} engine': best_of(lambda: ie.compile(source, cache=False, engine=engine), repeat=3)
+		for engine in ('ast', 'tokens')
+	}
+
+@benchmark
+def import_call(n=10_000):
+	"""time evaluating an import expression of an already imported module, compared to looking up a global"""
+	def loop(body, **kwargs):
+		code = ie.compile(f'def f():\n\tfor _ in range({n}):\n\t\t{body}', cache=False, **kwargs)
+		g = dict(collections=sys.modules['collections'])
+		ie.exec(code, g)
+		return best_of(g['f'], number=1) / n
+
+	import collections
+	return {
+		'global name': loop('collections'),
+		'builtin function call': loop('id(collections)'),
+		'imports=importlib': loop('collections!'),
+		'imports=cached': loop('collections!', imports='cached'),
+	}
+
+# modules that exist everywhere, so that synthetic modules can be executed
+_SYNTHETIC_IMPORTS = ['os.path!.join', 'collections!.Counter', 'json!.dumps', 're!.compile', 'functools!.partial']
+
+def synthetic_module(n_lines, density):
+	"""return a module of n_lines lines, of which the given fraction contain an import expression"""
+	lines = []
+	every = round(1 / density) if density else 0
+	for i in range(n_lines):
+		if every and i % every == 0:
+			lines.append(f'x{i} = {_SYNTHETIC_IMPORTS[i % len(_SYNTHETIC_IMPORTS)]}')
+		else:
+			lines.append(f'y{i} = [j * {i} for j in range({i % 7})]')
+	return '\n'.join(lines) + '\n'
+
+def corpora(*, quick=False):
+	"""return a dict of corpus name to a list of sources, from smallest to largest"""
+	result = {
+		'snippet': [b'os.path!.join("a", "b")'],
+		'1k lines, no !': [synthetic_module(1000, 0).encode()],
+		'1k lines, 1% !': [synthetic_module(1000, 0.01).encode()],
+		'1k lines, 10% !': [synthetic_module(1000, 0.1).encode()],
+		'1k lines, 100% !': [synthetic_module(1000, 1).encode()],
+	}
+	if not quick:
+		result['100k lines, 10% !'] = [synthetic_module(100_000, 0.1).encode()]
+	result['stdlib'] = [source for path, source in stdlib_corpus(limit=20 if quick else None)]
+	return result
+
+_quick = False
+
+@benchmark
+def stages():
+	"""time each stage of the compile pipeline, and running the result, on corpora of increasing size"""
+	from import_expression import _syntax
+
+	def time_stage(corpus, func, prepare=lambda source: source):
+		inputs = [prepare(source) for source in corpus]
+		def run():
+			for input in inputs:
+				func(input)
+		return best_of(run, repeat=3)
+
+	results = {}
+	for corpus_name, corpus in corpora(quick=_quick).items():
+		mode = 'eval' if corpus_name == 'snippet' else 'exec'
+		stages = {
+			'tokenize': (lambda source: list(_syntax.tokenize(source)[0]),),
+			'transform_tokens': (_syntax.transform_tokens, lambda source: list(_syntax.tokenize(source)[0])),
+			'fix_syntax': (_syntax.fix_syntax,),
+			'parse': (lambda source: ie.parse(source, mode=mode),),
+			'compile': (lambda source: ie.compile(source, mode=mode, cache=False),),
+			'compile, tokens engine': (lambda source: ie.compile(source, mode=mode, cache=False, engine='tokens'),),
+			'find_imports': (lambda source: ie.find_imports(source, mode=mode),),
+			'find_imports, tokens engine': (lambda source: ie.find_imports(source, mode=mode, engine='tokens'),),
+		}
+		# running the standard library would have side effects
+		if corpus_name != 'stdlib':
+			stages[mode] = (
+				lambda code: (ie.eval if mode == 'eval' else ie.exec)(code, {}),
+				lambda source: ie.compile(source, mode=mode, cache=False),
+			)
+
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore')
+			for stage, args in stages.items():
+				results[f'{corpus_name}: {stage}'] = time_stage(corpus, *args)
+
+	return results
+
+@benchmark
+def transform_ast():
+	"""time the AST transformation step on large modules, which should scale with the number of import expressions"""
+	from import_expression import _parser, _syntax
+
+	results = {}
+	n_lines = 10_000 if _quick else 100_000
+	for density in (0.001, 0.01, 0.1):
+		fixed = _syntax.fix_syntax(synthetic_module(n_lines, density))
+		# the tree is transformed in place, so each run needs a new one
+		trees = [ast.parse(fixed) for _ in range(3)]
+		def run():
+			_parser.transform_ast(trees.pop(), marker_lines=_parser.find_marker_lines(fixed))
+		results[f'{n_lines // 1000}k lines, {density:.1%} !'] = best_of(run, repeat=3, number=1)
+	return results
+
+@benchmark
+def find_imports():
+	"""time finding the imports of large modules and of what the REPL completer is given, with each engine"""
+	inputs = {
+		'100k lines, 10% !': [synthetic_module(1000 if _quick else 100_000, 0.1)],
+		'stdlib': [source for path, source in stdlib_corpus(limit=20 if _quick else None)],
+		# the completer is called with the word before the cursor, less any trailing dot, each time Tab is pressed
+		'completer': ['os.path!.jo', 'collections!.Counter', 'json!', 'importlib.machinery!.Source'],
+	}
+	if _quick:
+		inputs['1k lines, 10% !'] = inputs.pop('100k lines, 10% !')
+
+	results = {}
+	for name, sources in inputs.items():
+		for engine in ('ast', 'tokens'):
+			def run():
+				for source in sources:
+					ie.find_imports(source, engine=engine)
+			with warnings.catch_warnings():
+				warnings.simplefilter('ignore')
+				results[f'{name}, {engine} engine'] = best_of(run, repeat=3) / len(sources)
+	return results
+
+@benchmark
+def repl_latency():
+	"""time compiling typical lines entered into the REPL, including the lines of a block that are still incomplete"""
+	import codeop
+	from import_expression.__main__ import ImportExpressionCommandCompiler
+
+	inputs = [
+		'x = os.path!.join("a", "b")',
+		'y = x * 2',
+		'for i in range(3):',
+		'for i in range(3):\n\tprint(i, collections!.Counter(x))',
+		'for i in range(3):\n\tprint(i, collections!.Counter(x))\n',
+	]
+
+	# what other REPLs get by giving codeop import_expression.compile instead of builtins.compile
+	public_compiler = codeop.CommandCompiler()
+	public_compiler.compiler = lambda source, filename, symbol, **kwargs: ie.compile(
+		source,
+		filename,
+		symbol,
+		codeop.PyCF_DONT_IMPLY_DEDENT | getattr(codeop, 'PyCF_ALLOW_INCOMPLETE_INPUT', 0),
+		True,
+		cache=False,
+	)
+
+	results = {}
+	for label, compiler in (
+		('import-expression REPL', ImportExpressionCommandCompiler()),
+		('codeop with compile()', public_compiler),
+	):
+		def run():
+			for source in inputs:
+				compiler(source, '<console>', 'single')
+		results[label] = best_of(run) / len(inputs)
+	return results
+
+@benchmark
+def repl_paste():
+	"""time per line of pasting a block of code into the REPL, which compiles the whole block after every line"""
+	from import_expression.__main__ import ImportExpressionCommandCompiler
+
+	results = {}
+	for n in (100, 200, 400):
+		lines = ['class C:'] + [
+			line
+			for i in range(n // 2)
+			for line in (f'\tdef f{i}(self, x):', f'\t\treturn os.path!.join(x, "{i}")')
+		] + ['']
+
+		def paste():
+			compiler = ImportExpressionCommandCompiler()
+			for i in range(1, len(lines) + 1):
+				compiler('\n'.join(lines[:i]), '<console>', 'single')
+
+		results[f'{n} lines'] = best_of(paste, repeat=3) / len(lines)
+	return results
+
+@benchmark
+def threads(n_sources=256, calls_per_thread=2_000):
+	"""time compile throughput, as seconds per compile across all threads, at 1 to 16 threads"""
+	import concurrent.futures
+	import threading
+
+	gil = 'GIL' if getattr(sys, '_is_gil_enabled', lambda: True)() else 'free-threaded'
+	sources = [f'x = (os.path!.join("a", "{i}"), collections!.Counter)' for i in range(n_sources)]
+
+	def run(n_threads, calls, **kwargs):
+		# each thread starts at a different source, and they all start at once
+		barrier = threading.Barrier(n_threads + 1)
+
+		def work(offset):
+			barrier.wait()
+			for i in range(calls):
+				ie.compile(sources[(offset + i) % n_sources], **kwargs)
+
+		with concurrent.futures.ThreadPoolExecutor(n_threads) as pool:
+			futures = [pool.submit(work, i * n_sources // n_threads) for i in range(n_threads)]
+			barrier.wait()
+			start = time.perf_counter()
+			for future in futures:
+				future.result()
+			return (time.perf_counter() - start) / (n_threads * calls)
+
+	for source in sources:
+		ie.compile(source)
+
+	results = {}
+	for label, calls, kwargs in (
+		('cached', calls_per_thread, {}),
+		('uncached', calls_per_thread // 20, dict(cache=False)),
+	):
+		for n_threads in (1, 2, 4, 8, 16):
+			results[f'{label}, {n_threads} threads ({gil})'] = min(run(n_threads, calls, **kwargs) for _ in range(3))
+	return results
+
+@benchmark
+def per_record(n=10_000):
+	"""time evaluating an expression once per line, the way the README suggests and with compile_function"""
+	lines = [f'/var/log/app/{i}.log\n' for i in range(n)]
+	code = ie.compile('os.path!.basename(l)', mode='eval')
+	cached_code = ie.compile('os.path!.basename(l)', mode='eval', imports='cached')
+	function = ie.compile_function('os.path!.basename(l)', 'l')
+
+	def eval_source():
+		for line in lines:
+			ie.eval('os.path!.basename(l)', dict(l=line))
+
+	def eval_code(code):
+		for line in lines:
+			ie.eval(code, dict(l=line))
+
+	def call():
+		for line in lines:
+			function(line)
+
+	return {
+		'eval(source, dict(l=line))': best_of(eval_source) / n,
+		'eval(code, dict(l=line))': best_of(lambda: eval_code(code)) / n,
+		'eval(code, ...), imports="cached"': best_of(lambda: eval_code(cached_code)) / n,
+		'compile_function': best_of(call) / n,
+	}
+
+@benchmark
+def loop_latency(n_modules=20, repeat=5):
+	"""time the longest the event loop stalls while evaluating an import expression of a package that isn't imported"""
+	import asyncio
+
+	with temp_dir() as path, contextlib.ExitStack() as stack:
+		package = 'ie_bench_heavy'
+		package_path = os.path.join(path, package)
+		os.mkdir(package_path)
+		with open(os.path.join(package_path, '__init__.py'), 'w') as f:
+			f.write(''.join(f'from . import mod{i}\n' for i in range(n_modules)))
+			# stands in for reading from a slow file system, which releases the GIL like sleeping does
+			f.write('import time\ntime.sleep(0.05)\n')
+		for i in range(n_modules):
+			with open(os.path.join(package_path, f'mod{i}.py'), 'w') as f:
+				f.write(plain_module(20))
+
+		sys.path.insert(0, path)
+		stack.callback(sys.path.remove, path)
+		old_dont_write_bytecode = sys.dont_write_bytecode
+		sys.dont_write_bytecode = True
+		stack.callback(setattr, sys, 'dont_write_bytecode', old_dont_write_bytecode)
+
+		async def longest_stall(evaluate):
+			for name in [name for name in sys.modules if name.partition('.')[0] == package]:
+				del sys.modules[name]
+			importlib.invalidate_caches()
+
+			stall = 0
+			done = False
+
+			async def tick():
+				nonlocal stall
+				loop = asyncio.get_running_loop()
+				while not done:
+					start = loop.time()
+					await asyncio.sleep(0.001)
+					stall = max(stall, loop.time() - start - 0.001)
+
+			ticker = asyncio.create_task(tick())
+			await asyncio.sleep(0.01)
+			await evaluate(f'{package}!.mod0.f0(1)')
+			done = True
+			await ticker
+			return stall
+
+		async def blocking(source):
+			return ie.eval(source)
+
+		async def run():
+			return {
+				label: min([await longest_stall(evaluate) for _ in range(repeat)])
+				for label, evaluate in (('eval', blocking), ('aeval', ie.aeval))
+			}
+
+		return asyncio.run(run())
+
+@benchmark
+def stream(n=200_000):
+	"""time processing a file of JSON lines with import-expression -e and with a hand written python -c loop"""
+	with temp_dir() as path:
+		input_path = os.path.join(path, 'input.jsonl')
+		with open(input_path, 'w') as f:
+			for i in range(n):
+				f.write(f'{{"id": {i}, "level": "info", "message": "request {i} took {i % 97} ms"}}\n')
+
+		def run(*args):
+			with open(input_path) as input, open(os.devnull, 'w') as output:
+				subprocess.run(
+					[sys.executable, *args],
+					cwd=os.path.dirname(os.path.abspath(__file__)),
+					stdin=input,
+					stdout=output,
+					check=True,
+				)
+
+		results = {'python -c loop': best_of(lambda: run(
+			'-c', 'import json, sys\nfor line in sys.stdin:\n\tprint(json.loads(line)["id"])',
+		), repeat=3) / n}
+		for workers in (1, 2, 4):
+			results[f'-e, {workers} workers'] = best_of(lambda: run(
+				'-m', 'import_expression', '-j', str(workers), '-e', 'json!.loads(line)["id"]',
+			), repeat=3) / n
+		return results
+
+# the most time each startup benchmark may spend importing modules, going by -X importtime.
+# They're loose enough for a slow machine, so exceeding one means something heavy is imported up front again.
+STARTUP_BUDGETS = {
+	'import import_expression': 0.050,
+	'import-expression --version': 0.080,
+	'import-expression FILE': 0.070,
+}
+
+def import_seconds(*args):
+	"""return how long running Python with args spent importing modules that a bare interpreter doesn't import"""
+	def imports(*args):
+		process = subprocess.run(
+			[sys.executable, '-X', 'importtime', *args],
+			cwd=os.path.dirname(os.path.abspath(__file__)),
+			capture_output=True,
+			check=True,
+			text=True,
+		)
+		results = {}
+		for line in process.stderr.splitlines():
+			if not line.startswith('import time:'):
+				continue
+			_, cumulative, name = line.split('|')
+			# nested imports are indented, and are already counted in the cumulative time of their importer
+			if name.startswith('  '):
+				continue
+			with contextlib.suppress(ValueError):
+				results[name.strip()] = int(cumulative) / 1e6
+		return results
+
+	baseline = imports('-c', 'pass')
+	return min(
+		sum(seconds for name, seconds in imports(*args).items() if name not in baseline)
+		for _ in range(5)
+	)
+
+@benchmark
+def startup():
+	"""time the imports done by importing the package and by each kind of CLI invocation, checked against budgets"""
+	results = {}
+	with temp_dir() as path:
+		script = os.path.join(path, 'script.py')
+		with open(script, 'w') as f:
+			f.write('x = 1\n')
+
+		for label, args in (
+			('import import_expression', ['-c', 'import import_expression']),
+			('import-expression --version', ['-m', 'import_expression', '--version']),
+			('import-expression FILE', ['-m', 'import_expression', script]),
+		):
+			results[label] = seconds = import_seconds(*args)
+			if seconds > STARTUP_BUDGETS[label]:
+				warnings.warn(
+					f'{label} spent {format_seconds(seconds)} importing, '
+					f'over its budget of {format_seconds(STARTUP_BUDGETS[label])}'
+				)
+	return results
+
+def format_seconds(seconds):
+	for unit, scale in (('s', 1), ('ms', 1e-3), ('µs', 1e-6)):
+		if seconds >= scale:
+			return f'{seconds / scale:.3g} {unit}'
+	return f'{seconds / 1e-9:.3g} ns'
+
+def metadata():
+	revision = None
+	with contextlib.suppress(OSError, subprocess.CalledProcessError):
+		revision = subprocess.run(
+			['git', 'rev-parse', 'HEAD'],
+			cwd=os.path.dirname(os.path.abspath(__file__)),
+			capture_output=True,
+			check=True,
+			text=True,
+		).stdout.strip()
+
+	return dict(
+		revision=revision,
+		version=ie.__version__,
+		python=sys.version,
+		platform=platform.platform(),
+		date=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+	)
+
+def main():
+	global _quick
+
+	parser = argparse.ArgumentParser(description='run import_expression benchmarks')
+	parser.add_argument('names', nargs='*', metavar='NAME', help='one of: ' + ', '.join(benchmarks))
+	parser.add_argument('--json', metavar='FILE', help='also save the results to this file')
+	parser.add_argument('--compare', metavar='FILE', help='compare the results to those saved in this file')
+	parser.add_argument('--quick', action='store_true', help='use smaller corpora')
+	args = parser.parse_args()
+	for name in args.names:
+		if name not in benchmarks:
+			parser.error(f'unknown benchmark {name!r}')
+	_quick = args.quick
+
+	baseline = {}
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)['results']
+
+	results = {}
+	for name in args.names or benchmarks:
+		results[name] = benchmarks[name]()
+		for label, seconds in results[name].items():
+			line = f'{name:20} {label:40} {format_seconds(seconds):>12}'
+			old_seconds = baseline.get(name, {}).get(label)
+			if old_seconds:
+				line += f' {format_seconds(old_seconds):>12} {seconds / old_seconds:6.2f}x'
+			print(line)
+
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump(dict(metadata=metadata(), results=results), f, indent='\t')
+			f.write('\n')
+
+if __name__ == '__main__':
+	main()
@@ -22,25 +22,51 @@ import ast as _ast
 import builtins as _builtins
 import contextlib as _contextlib
 import importlib as _importlib
-import inspect as _inspect
+import keyword as _keyword
+import sys as _sys
 import typing as _typing
 import types as _types
 from codeop import PyCF_DONT_IMPLY_DEDENT
 
 from . import constants
+from . import _profiling
+from . import _runtime
+from ._cache import CodeCache as _CodeCache
 from ._syntax import fix_syntax as _fix_syntax
+from ._syntax import likely_contains_import_exprs as _likely_contains_import_exprs
+from ._syntax import find_imports as _find_import_tokens
 from ._parser import transform_ast as _transform_ast
+from ._parser import find_marker_lines as _find_marker_lines
 from ._parser import find_imports as _find_imports
+from ._profiling import profile
 from .version import __version__
 
 with _contextlib.suppress(NameError):
 	del version
 
-__all__ = ('compile', 'parse', 'eval', 'exec', 'constants')
+_runtime.install()
 
-_source = _typing.Union[_ast.AST, _typing.AnyStr]
+__all__ = (
+	'compile', 'parse', 'eval', 'exec', 'aeval', 'aexec', 'compile_function',
+	'cache_info', 'cache_clear', 'cache_configure',
+	'install', 'uninstall',
+	'prefetch', 'compile_many', 'find_imports_in_paths',
+	'profile',
+	'import_stats', 'import_stats_clear', 'import_stats_openmetrics',
+	'constants',
+)
 
-def parse(source: _source, filename=constants.DEFAULT_FILENAME, mode='exec', *, flags=0, **kwargs) -> _ast.AST:
+_source = _typing.Union[_ast.AST, str, _typing.ByteString]
+
+def parse(
+	source: _source,
+	filename=constants.DEFAULT_FILENAME,
+	mode='exec',
+	*,
+	flags=0,
+	imports='importlib',
+	**kwargs,
+) -> _ast.AST:
 	"""
 	convert Import Expression Python™ to an AST
 
@@ -53,18 +79,45 @@ def parse(source: _source, filename=constants.DEFAULT_FILENAME, mode='exec', *,
 
 	Filename is used in tracebacks, in case of invalid syntax or runtime exceptions.
 
+	Source may be an AST, a str, or any bytes-like object. See :func:`compile`.
+
+	imports: how the generated code imports modules. See :func:`compile`.
+
 	The remaining keyword arguments are passed to ast.parse as is.
 	"""
+	_check_imports(imports)
+
 	# for some API compatibility with ast, allow parse(parse('foo')) to work
 	if isinstance(source, _ast.AST):
-		return _transform_ast(source, filename=filename)
+		tree = _profiling.run('transform', _transform_ast, source, filename=filename, imports=imports)
+		# unlike the trees that we parse, this one may have been made by hand without locations
+		return _ast.fix_missing_locations(tree)
+
+	if not _likely_contains_import_exprs(source):
+		# if it's valid Python, there are no import expressions to transform.
+		# otherwise, the full pipeline reports the error the same way as if this had not been tried.
+		with _contextlib.suppress(SyntaxError, ValueError):
+			return _parse(source, filename, mode, flags, **kwargs)
+
+	return _parse_full(source, filename, mode, flags, imports, **kwargs)
+
+def _parse(source, filename, mode, flags, **kwargs):
+	if not kwargs:
+		# unlike ast.parse, this respects flags such as PyCF_DONT_IMPLY_DEDENT, raising the errors that codeop relies on
+		return _profiling.run('parse', _builtins.compile, source, filename, mode, flags | _ast.PyCF_ONLY_AST, True)
 
-	fixed = _fix_syntax(source, filename=filename)
 	if flags & PyCF_DONT_IMPLY_DEDENT:
 		# just run it for the syntax errors, which codeop picks up on
-		_builtins.compile(fixed, filename, mode, flags)
-	tree = _ast.parse(fixed, filename, mode, **kwargs)
-	return _transform_ast(tree, source=source, filename=filename)
+		_profiling.run('parse', _builtins.compile, source, filename, mode, flags)
+	return _profiling.run('parse', _ast.parse, source, filename, mode, **kwargs)
+
+def _parse_full(source, filename, mode, flags, imports='importlib', *, fix_syntax=_fix_syntax, **kwargs):
+	fixed = fix_syntax(source, filename=filename)
+	tree = _parse(fixed, filename, mode, flags, **kwargs)
+	return _profiling.run(
+		'transform', _transform_ast, tree,
+		source=source, filename=filename, imports=imports, marker_lines=_find_marker_lines(fixed),
+	)
 
 def compile(
 	source: _source,
@@ -73,19 +126,99 @@ def compile(
 	flags=0,
 	dont_inherit=False,
 	optimize=-1,
+	*,
+	cache=True,
+	engine='ast',
+	imports='importlib',
 ):
-	"""compile a string or AST containing import expressions to a code object"""
+	"""compile a string or AST containing import expressions to a code object
+
+	Besides str and bytes, source may be any other bytes-like object, such as a memoryview or an mmap of a file,
+	which is read a line at a time rather than copied whole.
+	Unless cache is False, code objects compiled from str and bytes are cached. See :func:`cache_info` for details.
+	Like the rest of the compile pipeline, the cache is safe to use from any number of threads at once.
+
+	engine selects how strings are compiled:
+	"ast" (the default) marks up the import expressions, parses the result, and rewrites the marked up AST nodes,
+	while "tokens" writes the import calls straight into the source code and compiles that, skipping the AST round trip.
+	Both produce equivalent code.
+
+	imports selects the code generated for each import expression:
+	"importlib" (the default) generates __import__("importlib").import_module(...),
+	which works anywhere, even if import_expression is not installed.
+	"cached" generates a call to a helper that returns the module straight from sys.modules if it's already imported,
+	which costs about as much as looking up a global variable.
+	It behaves the same as importlib.import_module, including after reloads or replacing modules in sys.modules,
+	but code compiled this way can only be run once import_expression has been imported.
+	"lazy" is like "cached", except that modules which aren't imported yet are loaded with importlib.util.LazyLoader,
+	so that they are only executed when one of their attributes is first accessed.
+	Modules that are already imported are returned as is, parent packages are always imported eagerly,
+	and so are modules that LazyLoader doesn't support:
+	built in, frozen, and extension modules, namespace packages, and modules that use other kinds of loaders.
+	"instrumented" behaves like "importlib", but records how many times each import expression ran and how long it took.
+	See :func:`import_stats`.
+	"""
+	if engine not in _ENGINES:
+		raise ValueError(f'engine must be one of {", ".join(map(repr, _ENGINES))}, not {engine!r}')
+	_check_imports(imports)
+
+	if not _is_source_code(source):
+		# an AST, or something that builtins.compile will raise a TypeError for
+		return _builtins.compile(source, filename, mode, flags, dont_inherit, optimize)
+
+	if not cache or flags & _ast.PyCF_ONLY_AST or not isinstance(source, (str, bytes)):
+		# ASTs are mutable, so they can't be shared between callers.
+		# other bytes-like objects such as memoryviews and mmaps aren't cached, as hashing them would mean copying them.
+		return _compile(source, filename, mode, flags, dont_inherit, optimize, engine, imports)
+
+	key = (source, mode, flags, dont_inherit, optimize, engine, imports)
+	code = _code_cache.get(key, filename)
+	if code is None:
+		code = _compile(source, filename, mode, flags, dont_inherit, optimize, engine, imports)
+		_code_cache.put(key, code)
+
+	return code
+
+def _is_source_code(source) -> bool:
 	if isinstance(source, (str, bytes)):
-		source = parse(source, filename=filename, mode=mode, flags=flags)
+		return True
+	try:
+		# views don't copy anything
+		with memoryview(source):
+			return True
+	except TypeError:
+		return False
+
+_ENGINES = ('ast', 'tokens')
+_IMPORTS = ('importlib', *constants.IMPORT_HELPERS)
 
-	return _builtins.compile(source, filename, mode, flags, dont_inherit, optimize)
+def _check_imports(imports):
+	if imports not in _IMPORTS:
+		raise ValueError(f'imports must be one of {", ".join(map(repr, _IMPORTS))}, not {imports!r}')
+
+def _compile(
+	source, filename, mode, flags, dont_inherit, optimize, engine='ast', imports='importlib',
+	*, fast=True, fix_syntax=_fix_syntax,
+):
+	if fast and not _likely_contains_import_exprs(source):
+		# if it's valid Python, there are no import expressions to transform.
+		# otherwise, the full pipeline reports the error the same way as if this had not been tried.
+		with _contextlib.suppress(SyntaxError, ValueError):
+			return _profiling.run('fast_path', _builtins.compile, source, filename, mode, flags, dont_inherit, optimize)
+
+	if engine == 'tokens':
+		fixed = fix_syntax(source, filename=filename, direct=True, imports=imports)
+		return _profiling.run('compile', _builtins.compile, fixed, filename, mode, flags, dont_inherit, optimize)
+
+	tree = _parse_full(source, filename, mode, flags, imports, fix_syntax=fix_syntax)
+	return _profiling.run('compile', _builtins.compile, tree, filename, mode, flags, dont_inherit, optimize)
 
 _code = _typing.Union[str, _types.CodeType]
 
 def eval(source: _code, globals=None, locals=None):
 	"""evaluate Import Expression Python™ in the given globals and locals"""
 	globals, locals = _parse_eval_exec_args(globals, locals)
-	if _inspect.iscode(source):
+	if isinstance(source, _types.CodeType):
 		return _builtins.eval(source, globals, locals)
 	return _builtins.eval(compile(source, constants.DEFAULT_FILENAME, 'eval'), globals, locals)
 
@@ -97,18 +230,266 @@ def exec(source: _code, globals=None, locals=None):
 	Therefore, if no globals are provided, the results will be discarded!
 	"""
 	globals, locals = _parse_eval_exec_args(globals, locals)
-	if _inspect.iscode(source):
+	if isinstance(source, _types.CodeType):
 		return _builtins.eval(source, globals, locals)
 	_builtins.eval(compile(source, constants.DEFAULT_FILENAME, 'exec'), globals, locals)
 
-def find_imports(source: str, filename=constants.DEFAULT_FILENAME, mode='exec'):
-	"""return a list of all module names required by the given source code."""
+def compile_function(
+	source: _source,
+	argnames=(),
+	filename=constants.DEFAULT_FILENAME,
+	mode='eval',
+	*,
+	globals=None,
+	name='<lambda>',
+	flags=0,
+	optimize=-1,
+	imports='cached',
+):
+	"""compile Import Expression Python™ to a function that takes the given arguments
+
+	This is for evaluating the same code many times with different values, such as once per line of a file:
+	calling the function costs the same as calling any other Python function,
+	whereas eval and exec look up the compile cache and set up globals on every call.
+
+	argnames is a sequence of parameter names, or a string of them separated by commas or spaces.
+	In eval mode, source is an expression, and the function returns its value.
+	In exec mode, source is the body of the function, which may use return.
+	The function's globals are the globals dict given, or a new empty one, shared by every call.
+	Line numbers in tracebacks are those of source, and the filename is filename.
+
+	imports defaults to "cached", so that each import expression imports its module on the first call,
+	and takes it straight from sys.modules after that. See :func:`compile`.
+	"""
+	if mode not in ('eval', 'exec'):
+		raise ValueError(f'mode must be "eval" or "exec", not {mode!r}')
+	if isinstance(argnames, str):
+		argnames = argnames.replace(',', ' ').split()
+	argnames = list(argnames)
+	for argname in argnames:
+		if not isinstance(argname, str) or not argname.isidentifier() or _keyword.iskeyword(argname):
+			raise ValueError(f'argument names must be identifiers, not {argname!r}')
+	if len(set(argnames)) != len(argnames):
+		raise ValueError(f'duplicate argument names in {argnames!r}')
+
+	tree = parse(source, filename, mode, flags=flags, imports=imports)
+	if mode == 'eval':
+		body = [_ast.copy_location(_ast.Return(value=tree.body), tree.body)]
+	else:
+		body = tree.body or [_ast.Pass(lineno=1, col_offset=0)]
+
+	function_fields = dict(
+		name=name,
+		args=_ast.arguments(
+			posonlyargs=[], args=[_ast.arg(arg=argname) for argname in argnames], vararg=None,
+			kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[],
+		),
+		body=body,
+		decorator_list=[],
+		returns=None,
+		lineno=1,
+		col_offset=0,
+	)
+	if 'type_params' in _ast.FunctionDef._fields:
+		# 3.12+
+		function_fields['type_params'] = []
+	module = _ast.Module(body=[_ast.FunctionDef(**function_fields)], type_ignores=[])
+	code = _profiling.run(
+		'compile', _builtins.compile, _ast.fix_missing_locations(module), filename, 'exec', flags, True, optimize,
+	)
+
+	function_code = next(const for const in code.co_consts if isinstance(const, _types.CodeType))
+	if globals is None:
+		globals = {}
+	# like eval and exec do, as FunctionType only does this itself on Python 3.10+
+	globals.setdefault('__builtins__', _builtins)
+	return _types.FunctionType(function_code, globals, name)
+
+async def aeval(source: _code, globals=None, locals=None, *, top_level_await=False, executor=None):
+	"""like :func:`eval`, but import the modules the source code needs in an executor first
+
+	This keeps the first evaluation of e.g. ``heavy.pkg!.f()`` from blocking the running event loop
+	while heavy.pkg is imported. The modules that aren't imported yet are imported on executor,
+	which defaults to the loop's default executor, and then the code is evaluated on the event loop.
+	Errors importing them are raised by the evaluation, the same as for eval.
+	Only source code is searched for modules to import; code objects are evaluated straight away.
+
+	If top_level_await is True, source code is compiled with ``ast.PyCF_ALLOW_TOP_LEVEL_AWAIT``.
+	Code that awaits at the top level is awaited, so this returns its result rather than a coroutine.
+	"""
+	return await _aeval_exec(source, 'eval', globals, locals, top_level_await, executor)
+
+async def aexec(source: _code, globals=None, locals=None, *, top_level_await=False, executor=None):
+	"""like :func:`exec`, but import the modules the source code needs in an executor first
+
+	See :func:`aeval` for details.
+	"""
+	await _aeval_exec(source, 'exec', globals, locals, top_level_await, executor)
+
+async def _aeval_exec(source, mode, globals, locals, top_level_await, executor):
+	import asyncio
+	import inspect
+
+	globals, locals = _parse_eval_exec_args(globals, locals)
+	if not isinstance(source, _types.CodeType):
+		flags = _ast.PyCF_ALLOW_TOP_LEVEL_AWAIT if top_level_await else 0
+		code = compile(source, constants.DEFAULT_FILENAME, mode, flags)
+		modules = [module for module in find_imports(source, mode=mode, engine='tokens') if module not in _sys.modules]
+		if modules:
+			from ._prefetch import prefetch_modules
+			await asyncio.get_running_loop().run_in_executor(executor, prefetch_modules, modules)
+	else:
+		code = source
+
+	result = _builtins.eval(code, globals, locals)
+	if code.co_flags & inspect.CO_COROUTINE:
+		result = await result
+	return result
+
+def find_imports(source: str, filename=constants.DEFAULT_FILENAME, mode='exec', *, positions=False, engine='ast'):
+	"""return a list of all module names required by the given source code.
+
+	If positions is True, each module is listed as a (module, line, column) tuple instead,
+	giving where its import expression starts. Both the line and column start from 1.
+
+	engine="tokens" finds the import expressions while tokenizing, without parsing the source code,
+	which is several times faster. The modules are listed in the order they appear in the source.
+	It doesn't check that the rest of the source code is valid, so the only SyntaxErrors it raises are for
+	source code containing import expressions that can't be tokenized, e.g. because of an unclosed bracket.
+	The default, "ast", raises a SyntaxError for any invalid source code.
+	"""
+	if engine not in _ENGINES:
+		raise ValueError(f'engine must be one of {", ".join(map(repr, _ENGINES))}, not {engine!r}')
+
 	# passing an AST is not supported because it doesn't make sense to.
 	# either the AST is one that we made, in which case the imports have already been made and calling parse_ast again
 	# would find no imports, or it's an AST made by parsing the output of fix_syntax, which is internal.
+	if not _likely_contains_import_exprs(source):
+		# if it's valid Python, there are no import expressions to find.
+		# even for the tokens engine, parsing valid Python is faster than tokenizing it with the tokenize module.
+		with _contextlib.suppress(SyntaxError, ValueError):
+			_ast.parse(source, filename, mode)
+			return []
+
+	if engine == 'tokens':
+		imports = _find_import_tokens(source, filename)
+		return imports if positions else [module for module, _, _ in imports]
+
 	fixed = _fix_syntax(source, filename=filename)
 	tree = _ast.parse(fixed, filename, mode)
-	return _find_imports(tree, filename=filename)
+	return _find_imports(
+		tree, filename=filename, source=source, positions=positions, marker_lines=_find_marker_lines(fixed),
+	)
+
+def prefetch(source: str, filename=constants.DEFAULT_FILENAME, mode='exec', *, max_workers=None):
+	"""import all modules required by the given source code ahead of running it
+
+	Modules under different top level packages are imported concurrently on up to max_workers threads,
+	which helps when finding them is slow, e.g. when sys.path is on a network file system.
+	Returns a list of (module, seconds, error) named tuples, one per module, in the order they appear in the source.
+	An exception raised while importing a module is returned as its error rather than raised.
+	"""
+	from ._prefetch import prefetch_modules
+	return prefetch_modules(find_imports(source, filename, mode), max_workers=max_workers)
+
+def compile_many(paths, *, workers=None, flags=0, optimize=-1, invalidation_mode=None, force=False):
+	"""write bytecode caches for the given files, and all .py files in the given directories, recursively
+
+	Files are compiled on a pool of worker processes, one per CPU unless workers is given.
+	The caches are written to __pycache__ in the same format as CPython's .pyc files, and are used by
+	the import-expression runner and the import hook installed by :func:`install`.
+	invalidation_mode is a py_compile.PycInvalidationMode, defaulting to the same as py_compile.
+	Files whose caches are already up to date are skipped unless force is True.
+
+	Returns a list of (path, compiled, error) named tuples, one per file, in order.
+	compiled is False for skipped files, and an exception raised while compiling a file is returned as its error
+	rather than raised, so one bad file doesn't stop the rest.
+	"""
+	from ._compileall import iter_compile
+	return list(iter_compile(
+		paths,
+		workers=workers,
+		flags=flags,
+		optimize=optimize,
+		invalidation_mode=invalidation_mode,
+		force=force,
+	))
+
+def find_imports_in_paths(paths, *, workers=None, cache=None):
+	"""find the modules imported by the given files, and all .py files in the given directories, recursively
+
+	Returns a generator of (path, imports, error) named tuples, one per file, in order,
+	where imports is a list of (module, line, column) tuples, as returned by :func:`find_imports` with positions=True.
+	An exception raised while reading or parsing a file is returned as its error rather than raised.
+
+	Files are scanned on a pool of worker processes, one per CPU unless workers is given.
+	cache is the path of a file to keep the imports of each file in. Files that haven't changed since they were
+	cached aren't scanned again. The cache file is updated once the generator finishes or is closed.
+	"""
+	from ._scan import iter_scan
+	return iter_scan(paths, workers=workers, cache=cache)
+
+_code_cache = _CodeCache()
+
+def cache_info():
+	"""return statistics about the compile cache used by :func:`compile`, :func:`eval`, and :func:`exec`
+
+	The result is a named tuple of hits, misses, evictions, maxsize, maxbytes, currsize, and currbytes.
+	currbytes is an estimate of the memory held by the cached code objects.
+	"""
+	return _code_cache.info()
+
+def cache_clear():
+	"""remove all entries from the compile cache and reset its statistics"""
+	_code_cache.clear()
+
+def cache_configure(maxsize=constants.DEFAULT_CACHE_SIZE, maxbytes=None):
+	"""set the limits of the compile cache, evicting least recently used entries as necessary
+
+	maxsize is the maximum number of code objects to keep and maxbytes is the maximum estimated size of them.
+	Pass None for either to remove that limit, or maxsize=0 to disable caching entirely.
+	Negative limits raise ValueError, leaving the cache as it was.
+	"""
+	_code_cache.configure(maxsize=maxsize, maxbytes=maxbytes)
+
+def import_stats():
+	"""return statistics about the import expressions compiled with imports="instrumented" that have run so far
+
+	The result is a dict of "filename:line:column" of each import expression to a dict of module name to a dict of
+	calls, hits, hit_seconds, misses, and miss_seconds.
+	Hits are calls where the module had already been imported, and misses are the rest.
+	"""
+	return _runtime.import_stats()
+
+def import_stats_clear():
+	"""reset the statistics returned by :func:`import_stats`"""
+	_runtime.import_stats_clear()
+
+def import_stats_openmetrics(prefix='import_expression'):
+	"""return the statistics returned by :func:`import_stats` in the OpenMetrics text format, used by Prometheus
+
+	The metrics are counters named <prefix>_imports and <prefix>_import_seconds,
+	with site, module, and result ("hit" or "miss") labels.
+	"""
+	return _runtime.import_stats_openmetrics(prefix)
+
+def install(packages=(), *, marker=False):
+	"""allow modules containing import expressions to be imported with the import statement
+
+	This installs a finder on sys.meta_path which compiles the given packages (and all their submodules)
+	as Import Expression Python™. If marker is True, any source file that has an "import-expression: on" comment
+	on its first or second line is compiled that way too, e.g. "# -*- import-expression: on -*-".
+
+	Bytecode for these modules is cached in __pycache__ like for any other module.
+	Returns the finder, which can be passed to :func:`uninstall`.
+	"""
+	from ._importer import install
+	return install(packages, marker=marker)
+
+def uninstall(finder=None):
+	"""remove the given finder installed by :func:`install`, or all of them if no finder is given"""
+	from ._importer import uninstall
+	uninstall(finder)
 
 def _parse_eval_exec_args(globals, locals):
 	if globals is None:
@@ -22,25 +22,10 @@
 # It is used under the Python Software Foundation License Version 2.
 # See LICENSE for details.
 
-import __future__
-import ast
-import asyncio
-import atexit
-import code
-import codeop
-import concurrent.futures
-import contextlib
-import importlib
-import inspect
+# Only what every invocation needs is imported up front, so that running a file or --version doesn't pay for the REPL.
+# The REPL lives in _repl, _bytecode is only imported to run a file, and asyncio is only imported for -a.
 import os.path
-import rlcompleter
 import sys
-import traceback
-import threading
-import types
-import warnings
-from asyncio import futures
-from codeop import PyCF_DONT_IMPLY_DEDENT, PyCF_ALLOW_INCOMPLETE_INPUT
 
 import import_expression
 from import_expression import constants
@@ -52,8 +37,6 @@ if os.path.basename(sys.argv[0]) == 'import_expression':
 		'Please use import-expression (with a hyphen) instead.'
 	))
 
-features = [getattr(__future__, fname) for fname in __future__.all_feature_names]
-
 try:
 	from ast import PyCF_ALLOW_TOP_LEVEL_AWAIT
 except ImportError:
@@ -61,161 +44,19 @@ except ImportError:
 else:
 	SUPPORTS_ASYNCIO_REPL = True
 
-class ImportExpressionCommandCompiler(codeop.CommandCompiler):
-	def __init__(self):
-		super().__init__()
-		self.compiler = ImportExpressionCompile()
-
-# this must be vendored as codeop.Compile is hardcoded to use builtins.compile
-class ImportExpressionCompile:
-	"""Instances of this class behave much like the built-in compile
-	function, but if one is used to compile text containing a future
-	statement, it "remembers" and compiles all subsequent program texts
-	with the statement in force."""
-	def __init__(self):
-		self.flags = PyCF_DONT_IMPLY_DEDENT | PyCF_ALLOW_INCOMPLETE_INPUT
-
-	def __call__(self, source, filename, symbol, **kwargs):
-		flags = self.flags
-		if kwargs.get('incomplete_input', True) is False:
-			flags &= ~PyCF_DONT_IMPLY_DEDENT
-			flags &= ~PyCF_ALLOW_INCOMPLETE_INPUT
-		codeob = import_expression.compile(source, filename, symbol, flags, True)
-		for feature in features:
-			if codeob.co_flags & feature.compiler_flag:
-				self.flags |= feature.compiler_flag
-		return codeob
-
-class ImportExpressionInteractiveConsole(code.InteractiveConsole):
-	def __init__(self, locals=None, filename='<console>'):
-		super().__init__(locals, filename)
-		self.compile = ImportExpressionCommandCompiler()
-
-# we must vendor this class because it creates global variables that the main code depends on
-class ImportExpressionAsyncIOInteractiveConsole(ImportExpressionInteractiveConsole):
-	def __init__(self, locals, loop):
-		super().__init__(locals)
-		self.loop = loop
-		self.locals.update(dict(asyncio=asyncio, loop=loop))
-		self.compile.compiler.flags |= PyCF_ALLOW_TOP_LEVEL_AWAIT
-
-		self.loop = loop
-
-	def runcode(self, code):
-		future = concurrent.futures.Future()
-
-		def callback():
-			global repl_future
-			global repl_future_interrupted
-
-			repl_future = None
-			repl_future_interrupted = False
-
-			func = types.FunctionType(code, self.locals)
-			try:
-				coro = func()
-			except SystemExit:
-				raise
-			except KeyboardInterrupt as ex:
-				repl_future_interrupted = True
-				future.set_exception(ex)
-				return
-			except BaseException as ex:
-				future.set_exception(ex)
-				return
-
-			if not inspect.iscoroutine(coro):
-				future.set_result(coro)
-				return
-
-			try:
-				repl_future = self.loop.create_task(coro)
-				futures._chain_future(repl_future, future)
-			except BaseException as exc:
-				future.set_exception(exc)
-
-		self.loop.call_soon_threadsafe(callback)
-
-		try:
-			return future.result()
-		except SystemExit:
-			raise
-		except BaseException:
-			if repl_future_interrupted:
-				self.write("\nKeyboardInterrupt\n")
-			else:
-				self.showtraceback()
-
-class REPLThread(threading.Thread):
-	def __init__(self, interact_kwargs):
-		self.interact_kwargs = interact_kwargs
-		super().__init__()
-
-	def run(self):
-		try:
-			console.interact(**self.interact_kwargs)
-		finally:
-			warnings.filterwarnings(
-				'ignore',
-				message=r'^coroutine .* was never awaited$',
-				category=RuntimeWarning,
-			)
+# -m command name -> the module whose main(argv) runs it
+COMMANDS = {
+	'compileall': 'import_expression._compileall',
+	'scan': 'import_expression._scan',
+}
 
-			loop.call_soon_threadsafe(loop.stop)
-
-class ImportExpressionCompleter(rlcompleter.Completer):
-	def attr_matches(self, text):
-		# hack to help ensure valid syntax
-		mod_names = import_expression.find_imports(text.rstrip().rstrip('.'))
-		if not mod_names:
-			return super().attr_matches(text)
-		mod_name = mod_names[0]
-		mod_name_with_import_op = mod_name + constants.IMPORT_OP
-		# don't import the module in our current namespace, otherwise tab completion would also have side effects
-		old_namespace = self.namespace
-		# __import__ is used instead of importlib.import_module
-		# because __import__ is designed for updating module-level globals, which we are doing.
-		# Specifically, __import__('x.y') returns x, which is necessary for tab completion.
-		mod = __import__(mod_name)
-		self.namespace = {mod.__name__: mod}
-		res = [
-			# this is a hack because it also replaces non-identifiers
-			# however, readline / rlcompleter only operates on identifiers so it's OK i guess
-			# we need to replace so that the tab completions all have the correct prefix
-			match.replace(mod_name, mod_name_with_import_op, 1)
-			for match
-			in super().attr_matches(text.replace(mod_name_with_import_op, mod_name))
-		]
-		self.namespace = old_namespace
-		return res
-
-def asyncio_main(repl_locals, interact_kwargs):
-	global console
-	global loop
-	global repl_future
-	global repl_future_interrupted
-
-	loop = asyncio.get_event_loop()
-
-	console = ImportExpressionAsyncIOInteractiveConsole(repl_locals, loop)
-
-	repl_future = None
-	repl_future_interrupted = False
-
-	repl_thread = REPLThread(interact_kwargs)
-	repl_thread.daemon = True
-	repl_thread.start()
-
-	while True:
-		try:
-			loop.run_forever()
-		except KeyboardInterrupt:
-			if repl_future and not repl_future.done():
-				repl_future.cancel()
-				repl_future_interrupted = True
-			continue
-		else:
-			break
+def __getattr__(name):
+	# the REPL classes used to be defined here
+	from import_expression import _repl
+	try:
+		return getattr(_repl, name)
+	except AttributeError:
+		raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
 
 def parse_args():
 	import argparse
@@ -230,32 +71,124 @@ def parse_args():
 	parser.add_argument('-a', '--asyncio', action='store_true', help='use the asyncio REPL (python 3.8+)')
 	parser.add_argument('-i', dest='interactive', action='store_true', help='inspect interactively after running script')
 	parser.add_argument('-V', '--version', action='version', version=version_info)
-	parser.add_argument('filename', help='run this file', nargs='?')
+	parser.add_argument(
+		'-m', dest='command', choices=sorted(COMMANDS),
+		help=(
+			'run a command instead, passing it the rest of the arguments: '
+			'"compileall" writes the bytecode caches of files, and "scan" lists the modules they import. '
+			'It must be the first argument. Run -m COMMAND --help for its options'
+		),
+	)
+	parser.add_argument(
+		'-B', '--no-cache', action='store_true',
+		help="don't read or write the bytecode cache of the file being run",
+	)
+	parser.add_argument(
+		'--invalidation-mode',
+		choices=['checked-hash', 'timestamp', 'unchecked-hash'],
+		help=(
+			'how the bytecode cache of the file being run is checked against the source. '
+			'The default is "timestamp", or "checked-hash" if the SOURCE_DATE_EPOCH environment variable is set.'
+		),
+	)
+	parser.add_argument(
+		'--prefetch', action='store_true',
+		help='import the modules used by import expressions in the file concurrently before running it',
+	)
+	parser.add_argument(
+		'--prefetch-report', action='store_true',
+		help='like --prefetch, and print how long each module took to import to stderr',
+	)
+	parser.add_argument(
+		'--completion-timeout', type=float, default=constants.DEFAULT_COMPLETION_TIMEOUT, metavar='SECONDS',
+		help=(
+			'how long tab completion waits for a module to be imported. '
+			'Slower imports carry on in the background, and are completed on a later Tab'
+		),
+	)
+	parser.add_argument('filename', help='run this file, or with -e, read this file instead of stdin', nargs='?')
 
-	return parser.parse_args()
+	stream = parser.add_argument_group(
+		'processing lines',
+		'evaluate an expression for each line of stdin or a file, like awk, and print each result that is not None. '
+		'The expression is compiled once, and sees the line without its newline as line, and its line number as n',
+	)
+	stream.add_argument('-e', '--expression', metavar='EXPRESSION', help='the expression to evaluate for each line')
+	stream.add_argument(
+		'--filter', action='store_true', help='print the lines that the expression is true for, instead of its results',
+	)
+	stream.add_argument('--begin', metavar='CODE', help='run this code before the first line, in the same globals')
+	stream.add_argument('--end', metavar='CODE', help='run this code after the last line, in the same globals')
+	stream.add_argument(
+		'-0', '--null', action='store_true', help='separate lines in the input and output with NUL characters',
+	)
+	stream.add_argument(
+		'--batch-size', type=int, default=constants.DEFAULT_STREAM_BATCH_SIZE, metavar='LINES',
+		help='how many lines to read, process, and write at a time',
+	)
+	stream.add_argument(
+		'-j', '--workers', type=int, default=1,
+		help=(
+			'the number of processes to evaluate the expression on. Output stays in order. '
+			'Each process runs --begin, and --end only sees what --begin did'
+		),
+	)
 
-def setup_history_and_tab_completion(locals):
-	try:
-		import readline
-		import site
-		import rlcompleter
-	except ImportError:
-		# readline is not available on all platforms
-		return
+	args = parser.parse_args()
+	if args.command is not None:
+		# main runs commands before getting here
+		parser.error('-m must be the first argument')
+	return args
 
-	try:
-		# set up history
-		sys.__interactivehook__()
-	except AttributeError:
-		# site has not set __interactivehook__ because python was run without site packages
+def prefetch(filename, *, report=False):
+	import tokenize
+
+	with tokenize.open(filename) as f:
+		source = f.read()
+
+	results = import_expression.prefetch(source, filename)
+	if not report:
 		return
 
-	# allow completion of text containing an import op (otherwise it is treated as a word boundary)
-	readline.set_completer_delims(readline.get_completer_delims().replace(constants.IMPORT_OP, ''))
-	# inform tab completion of what variables were set at the REPL
-	readline.set_completer(ImportExpressionCompleter(locals).complete)
+	for module, seconds, error in results:
+		line = f'prefetch: {seconds * 1e3:9.3f} ms {module}'
+		if error is not None:
+			line += f' ({type(error).__name__}: {error})'
+		print(line, file=sys.stderr)
+
+def process_lines(args):
+	from import_expression import _stream
+
+	input = sys.stdin
+	if args.filename is not None and args.filename != '-':
+		input = open(args.filename)
+	try:
+		with input:
+			_stream.run(
+				args.expression,
+				input,
+				sys.stdout,
+				filter=args.filter,
+				begin=args.begin,
+				end=args.end,
+				separator='\0' if args.null else '\n',
+				batch_size=args.batch_size,
+				workers=args.workers,
+			)
+			sys.stdout.flush()
+	except BrokenPipeError:
+		# the reader, e.g. head, has seen enough. Python would otherwise complain about it when flushing stdout at exit
+		os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+		return 1
+	return 0
 
 def main():
+	# like python -m, so that commands can't be mistaken for files to run
+	if sys.argv[1:2] == ['-m'] and sys.argv[2:3] and sys.argv[2] in COMMANDS:
+		import importlib
+		command = importlib.import_module(COMMANDS[sys.argv[2]])
+		sys.exit(command.main(sys.argv[3:]))
+
 	cwd = os.getcwd()
 	if cwd not in sys.path:
 		# if invoked as a script, the user would otherwise not be able to import modules from the cwd,
@@ -273,17 +206,34 @@ def main():
 
 	args = parse_args()
 
+	if args.expression is not None:
+		sys.exit(process_lines(args))
+
 	if args.asyncio and not SUPPORTS_ASYNCIO_REPL:
 		print('Python3.8+ required for the AsyncIO REPL.', file=sys.stderr)
 		sys.exit(2)
 
 	if args.filename:
-		with open(args.filename) as f:
-			flags = 0
-			if args.asyncio:
-				flags |= PyCF_ALLOW_TOP_LEVEL_AWAIT
-			prelude = import_expression.compile(f.read(), flags=flags)
+		from import_expression import _bytecode
+
+		flags = 0
+		if args.asyncio:
+			flags |= PyCF_ALLOW_TOP_LEVEL_AWAIT
+		invalidation_mode = None
+		if args.invalidation_mode:
+			invalidation_mode = _bytecode.PycInvalidationMode[args.invalidation_mode.upper().replace('-', '_')]
+		prelude = _bytecode.get_code(
+			args.filename,
+			flags=flags,
+			invalidation_mode=invalidation_mode,
+			use_cache=not args.no_cache,
+		)
+		if args.prefetch or args.prefetch_report:
+			prefetch(args.filename, report=args.prefetch_report)
 		if args.asyncio:
+			import asyncio
+			import inspect
+
 			prelude_result = eval(prelude, repl_locals)
 			# if there are no top level awaits in the code, eval will not return a coroutine
 			if inspect.isawaitable(prelude_result):
@@ -295,15 +245,17 @@ def main():
 		if not args.interactive:
 			sys.exit(0)
 
-	setup_history_and_tab_completion(repl_locals)
+	from import_expression import _repl
+
+	_repl.setup_history_and_tab_completion(repl_locals, completion_timeout=args.completion_timeout)
 
 	interact_kwargs = dict(banner='' if args.quiet else None, exitmsg='' if args.quiet else None)
 
 	if args.asyncio:
-		asyncio_main(repl_locals, interact_kwargs)
+		_repl.asyncio_main(repl_locals, interact_kwargs)
 		sys.exit(0)
 
-	ImportExpressionInteractiveConsole(repl_locals).interact(**interact_kwargs)
+	_repl.ImportExpressionInteractiveConsole(repl_locals).interact(**interact_kwargs)
 
 if __name__ == '__main__':
 	main()
@@ -0,0 +1,246 @@
+# Copyright © io mintz <io@mintz.cc>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”),
+# to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Reading and writing of bytecode caches in the same format as CPython's .pyc files (see PEP 552).
+
+import _imp
+import contextlib
+import importlib.util
+import marshal
+import os
+import sys
+import types
+
+from . import compile
+
+try:
+	from ast import PyCF_ALLOW_TOP_LEVEL_AWAIT
+except ImportError:
+	PyCF_ALLOW_TOP_LEVEL_AWAIT = 0
+
+_FLAG_HASH_BASED = 0b01
+_FLAG_CHECK_SOURCE = 0b10
+
+# py_compile imports traceback, which running a file doesn't otherwise need,
+# so it's only imported once an invalidation mode is actually asked for
+def __getattr__(name):
+	if name == 'PycInvalidationMode':
+		from py_compile import PycInvalidationMode
+		return PycInvalidationMode
+	raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def default_invalidation_mode():
+	from py_compile import PycInvalidationMode
+	return PycInvalidationMode.CHECKED_HASH if _default_pyc_flags() else PycInvalidationMode.TIMESTAMP
+
+def _default_pyc_flags():
+	# same as py_compile
+	if os.environ.get('SOURCE_DATE_EPOCH'):
+		return _FLAG_HASH_BASED | _FLAG_CHECK_SOURCE
+	return 0
+
+def cache_from_source(path, *, optimize=-1, flags=0) -> str:
+	"""return the path of the bytecode cache for the given source file.
+
+	Code compiled with top level await enabled behaves differently, so it is cached separately.
+	"""
+	if optimize < 0:
+		optimize = sys.flags.optimize
+	optimization = str(optimize) if optimize else ''
+	if flags & PyCF_ALLOW_TOP_LEVEL_AWAIT:
+		optimization = 'await' + optimization
+	return importlib.util.cache_from_source(path, optimization=optimization)
+
+def _pack_uint32(x):
+	return (int(x) & 0xFFFFFFFF).to_bytes(4, 'little')
+
+def _unpack_uint32(data):
+	return int.from_bytes(data, 'little')
+
+def code_to_pyc(code, *, source_bytes=None, source_stats=None, invalidation_mode=None) -> bytes:
+	"""invalidation_mode defaults to timestamp based, like py_compile.PycInvalidationMode.TIMESTAMP"""
+	pyc_flags = 0 if invalidation_mode is None else _mode_flags(invalidation_mode)
+	return _code_to_pyc(code, source_bytes=source_bytes, source_stats=source_stats, pyc_flags=pyc_flags)
+
+def _code_to_pyc(code, *, source_bytes, source_stats, pyc_flags):
+	data = bytearray(importlib.util.MAGIC_NUMBER)
+	data += _pack_uint32(pyc_flags)
+	if pyc_flags & _FLAG_HASH_BASED:
+		data += importlib.util.source_hash(source_bytes)
+	else:
+		data += _pack_uint32(source_stats.st_mtime)
+		data += _pack_uint32(source_stats.st_size)
+	data += marshal.dumps(code)
+	return bytes(data)
+
+def is_up_to_date(data, *, source_stats, get_source_bytes, invalidation_mode=None) -> bool:
+	"""check whether the header of the given bytecode cache matches its source.
+
+	get_source_bytes is only called for hash based caches.
+	If invalidation_mode is given, caches using a different mode are considered out of date.
+	"""
+	pyc_flags = None if invalidation_mode is None else _mode_flags(invalidation_mode)
+	return _is_up_to_date(data, source_stats=source_stats, get_source_bytes=get_source_bytes, pyc_flags=pyc_flags)
+
+def _is_up_to_date(data, *, source_stats, get_source_bytes, pyc_flags):
+	if len(data) < 16 or data[:4] != importlib.util.MAGIC_NUMBER:
+		return False
+
+	flags = _unpack_uint32(data[4:8])
+	if flags & ~(_FLAG_HASH_BASED | _FLAG_CHECK_SOURCE):
+		return False
+
+	if pyc_flags is not None and flags != pyc_flags:
+		return False
+
+	if not flags & _FLAG_HASH_BASED:
+		return (
+			_unpack_uint32(data[8:12]) == int(source_stats.st_mtime) & 0xFFFFFFFF
+			and _unpack_uint32(data[12:16]) == source_stats.st_size & 0xFFFFFFFF
+		)
+
+	# respect --check-hash-based-pycs, like the import system does
+	check_source = flags & _FLAG_CHECK_SOURCE
+	if _imp.check_hash_based_pycs == 'never':
+		check_source = False
+	elif _imp.check_hash_based_pycs == 'always':
+		check_source = True
+
+	return not check_source or data[8:16] == importlib.util.source_hash(get_source_bytes())
+
+def _mode_flags(invalidation_mode):
+	from py_compile import PycInvalidationMode
+	if invalidation_mode == PycInvalidationMode.TIMESTAMP:
+		return 0
+	if invalidation_mode == PycInvalidationMode.CHECKED_HASH:
+		return _FLAG_HASH_BASED | _FLAG_CHECK_SOURCE
+	return _FLAG_HASH_BASED
+
+def code_from_pyc(data):
+	try:
+		code = marshal.loads(memoryview(data)[16:])
+	except (EOFError, ValueError, TypeError):
+		return None
+	return code if isinstance(code, types.CodeType) else None
+
+def write_atomic(path, data):
+	"""write data to path such that readers never see a partially written file"""
+	tmp = f'{path}.{os.getpid()}.{id(data)}'
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	try:
+		with open(tmp, 'wb') as f:
+			f.write(data)
+		os.replace(tmp, path)
+	except OSError:
+		try:
+			os.unlink(tmp)
+		except OSError:
+			pass
+		raise
+
+class _Source:
+	"""a source file whose contents are only read when needed"""
+
+	def __init__(self, path):
+		self.path = path
+		self.stats = os.stat(path)
+		self._bytes = None
+
+	def get_bytes(self):
+		if self._bytes is None:
+			with open(self.path, 'rb') as f:
+				self._bytes = f.read()
+		return self._bytes
+
+def _read_cache(cache_path, source, pyc_flags):
+	try:
+		with open(cache_path, 'rb') as f:
+			data = f.read()
+	except OSError:
+		return None
+
+	if not _is_up_to_date(
+		data,
+		source_stats=source.stats,
+		get_source_bytes=source.get_bytes,
+		pyc_flags=pyc_flags,
+	):
+		return None
+
+	return code_from_pyc(data)
+
+def _compile(source, *, flags, optimize):
+	return compile(source.get_bytes(), source.path, 'exec', flags=flags, dont_inherit=True, optimize=optimize, cache=False)
+
+def _write_cache(cache_path, code, source, pyc_flags):
+	write_atomic(cache_path, _code_to_pyc(
+		code,
+		source_bytes=source.get_bytes() if pyc_flags & _FLAG_HASH_BASED else None,
+		source_stats=source.stats,
+		pyc_flags=pyc_flags,
+	))
+
+def get_code(path, *, flags=0, optimize=-1, invalidation_mode=None, use_cache=True) -> types.CodeType:
+	"""compile the Import Expression Python™ source file at path, reusing its bytecode cache if it is up to date.
+
+	Otherwise the cache is (re)written, unless use_cache is False or sys.dont_write_bytecode is set.
+	If invalidation_mode is None, any valid cache is used, checked according to its own mode like the import system does,
+	e.g. one written by compile_file with a hash based mode, and caches are written with the default mode.
+	Otherwise only caches written with that mode are used.
+	"""
+	source = _Source(path)
+	cache_path = cache_from_source(path, optimize=optimize, flags=flags)
+	pyc_flags = None if invalidation_mode is None else _mode_flags(invalidation_mode)
+
+	if use_cache:
+		code = _read_cache(cache_path, source, pyc_flags)
+		if code is not None:
+			# the cache may have been written when the file was run through a different path, e.g. from another directory.
+			# like the import system, report the path it's being run through now
+			_imp._fix_co_filename(code, path)
+			return code
+
+	code = _compile(source, flags=flags, optimize=optimize)
+
+	if use_cache and not sys.dont_write_bytecode:
+		if pyc_flags is None:
+			pyc_flags = _default_pyc_flags()
+		# the cache is only an optimization, e.g. the directory may be read only
+		with contextlib.suppress(OSError):
+			_write_cache(cache_path, code, source, pyc_flags)
+
+	return code
+
+def compile_file(path, *, flags=0, optimize=-1, invalidation_mode=None, force=False) -> bool:
+	"""write the bytecode cache of the Import Expression Python™ source file at path.
+
+	Returns False without compiling if the cache is already up to date, unless force is True.
+	Unlike get_code, errors writing the cache are raised and sys.dont_write_bytecode is ignored, like compileall.
+	"""
+	pyc_flags = _default_pyc_flags() if invalidation_mode is None else _mode_flags(invalidation_mode)
+
+	source = _Source(path)
+	cache_path = cache_from_source(path, optimize=optimize, flags=flags)
+
+	if not force and _read_cache(cache_path, source, pyc_flags) is not None:
+		return False
+
+	_write_cache(cache_path, _compile(source, flags=flags, optimize=optimize), source, pyc_flags)
+	return True
@@ -0,0 +1,183 @@
+# Copyright © io mintz <io@mintz.cc>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”),
+# to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import marshal
+import threading
+import types
+from collections import OrderedDict, namedtuple
+
+from .constants import *
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses evictions maxsize maxbytes currsize currbytes')
+
+def replace_filename(code: types.CodeType, filename: str) -> types.CodeType:
+	"""return a copy of code (and all code objects nested within it) that reports the given filename"""
+	if code.co_filename == filename:
+		return code
+
+	consts = tuple(
+		replace_filename(const, filename) if isinstance(const, types.CodeType) else const
+		for const in code.co_consts
+	)
+	return code.replace(co_filename=filename, co_consts=consts)
+
+class _Shard:
+	"""One least recently used part of a CodeCache, with its own lock."""
+
+	__slots__ = ('lock', 'entries', 'currbytes', 'hits', 'misses', 'evictions', 'maxsize', 'maxbytes')
+
+	def __init__(self, maxsize, maxbytes):
+		self.lock = threading.Lock()
+		# key -> (code, size)
+		self.entries = OrderedDict()
+		self.currbytes = 0
+		self.hits = self.misses = self.evictions = 0
+		self.maxsize = maxsize
+		self.maxbytes = maxbytes
+
+	def evict(self):
+		while self.entries and (
+			self.maxsize is not None and len(self.entries) > self.maxsize
+			or self.maxbytes is not None and self.currbytes > self.maxbytes
+		):
+			_, (_, size) = self.entries.popitem(last=False)
+			self.currbytes -= size
+			self.evictions += 1
+
+	def clear(self):
+		self.entries.clear()
+		self.currbytes = 0
+		self.hits = self.misses = self.evictions = 0
+
+class CodeCache:
+	"""A bounded, least recently used cache of compiled code objects.
+
+	Entries are keyed on everything that affects compilation except the filename.
+	A hit for a different filename than the entry was compiled with returns a copy rebound to the new filename,
+	so the same source compiled under many filenames is only stored once.
+
+	maxsize limits the number of entries and maxbytes limits the approximate memory used by them.
+	Either may be None for no limit. A maxsize of 0 disables the cache.
+
+	It is safe to use from any number of threads, including on free-threaded builds of Python.
+	So that threads compiling different sources don't wait for each other, a large cache is split into shards
+	by the hash of the source, each with its own lock, and maxsize and maxbytes are divided evenly between them.
+	Entries are evicted least recently used first within each shard.
+	A cache with a maxsize under MIN_SHARDED_SIZE has a single shard, so that it's exactly least recently used.
+	"""
+
+	SHARDS = 16
+	MIN_SHARDED_SIZE = SHARDS * 16
+
+	def __init__(self, maxsize=DEFAULT_CACHE_SIZE, maxbytes=None):
+		# replaced all at once by configure, so that readers never see a half configured cache
+		self._shards = self._make_shards(maxsize, maxbytes)
+		# taken by the methods that touch every shard, so that they don't interleave
+		self._lock = threading.Lock()
+		self.maxsize = maxsize
+		self.maxbytes = maxbytes
+
+	@classmethod
+	def _make_shards(cls, maxsize, maxbytes):
+		for name, limit in (('maxsize', maxsize), ('maxbytes', maxbytes)):
+			if limit is not None and limit < 0:
+				raise ValueError(f'{name} must be None or at least 0, not {limit!r}')
+		n = cls.SHARDS if maxsize is None or maxsize >= cls.MIN_SHARDED_SIZE else 1
+		return tuple(_Shard(_divide(maxsize, n), _divide(maxbytes, n)) for _ in range(n))
+
+	def _shard(self, key):
+		shards = self._shards
+		# the hash of the source is cached by the str or bytes object, unlike that of the whole key
+		return shards[hash(key[0]) % len(shards)]
+
+	def get(self, key, filename):
+		# the hot path, so _shard is inlined
+		shards = self._shards
+		shard = shards[hash(key[0]) % len(shards)]
+		with shard.lock:
+			try:
+				code, _ = shard.entries[key]
+			except KeyError:
+				shard.misses += 1
+				return None
+			shard.entries.move_to_end(key)
+			shard.hits += 1
+
+		return replace_filename(code, filename)
+
+	def put(self, key, code):
+		shard = self._shard(key)
+		if shard.maxsize == 0:
+			return
+
+		# the marshalled size is a reasonable estimate of how much memory a code object holds on to
+		size = len(key[0]) + len(marshal.dumps(code))
+		if shard.maxbytes is not None and size > shard.maxbytes:
+			return
+
+		with shard.lock:
+			old = shard.entries.pop(key, None)
+			if old is not None:
+				shard.currbytes -= old[1]
+			shard.entries[key] = code, size
+			shard.currbytes += size
+			shard.evict()
+
+	def configure(self, maxsize=DEFAULT_CACHE_SIZE, maxbytes=None):
+		with self._lock:
+			old_shards = self._shards
+			new_shards = self._make_shards(maxsize, maxbytes)
+			for shard in old_shards:
+				with shard.lock:
+					# hold on to the statistics and the most recently used entries
+					for key, entry in shard.entries.items():
+						new_shard = new_shards[hash(key[0]) % len(new_shards)]
+						new_shard.entries[key] = entry
+						new_shard.currbytes += entry[1]
+					new_shards[0].hits += shard.hits
+					new_shards[0].misses += shard.misses
+					new_shards[0].evictions += shard.evictions
+			for shard in new_shards:
+				shard.evict()
+			self._shards = new_shards
+			self.maxsize = maxsize
+			self.maxbytes = maxbytes
+
+	def info(self) -> CacheInfo:
+		with self._lock:
+			hits = misses = evictions = currsize = currbytes = 0
+			for shard in self._shards:
+				with shard.lock:
+					hits += shard.hits
+					misses += shard.misses
+					evictions += shard.evictions
+					currsize += len(shard.entries)
+					currbytes += shard.currbytes
+			return CacheInfo(hits, misses, evictions, self.maxsize, self.maxbytes, currsize, currbytes)
+
+	def clear(self):
+		with self._lock:
+			for shard in self._shards:
+				with shard.lock:
+					shard.clear()
+
+def _divide(limit, n):
+	"""split limit between n shards, rounding up so that the shards can hold at least limit between them"""
+	return None if limit is None else -(-limit // n)
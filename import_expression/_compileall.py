@@ -0,0 +1,128 @@
+# Copyright © io mintz <io@mintz.cc>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”),
+# to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Writing bytecode caches for whole directory trees ahead of time, like the compileall module.
+
+import argparse
+import concurrent.futures
+import functools
+import os
+import sys
+from collections import namedtuple
+
+from . import _bytecode
+
+CompileResult = namedtuple('CompileResult', 'path compiled error')
+
+def find_sources(paths):
+	"""yield each of the given files, and every .py file in each of the given directories, recursively"""
+	for path in paths:
+		path = os.fspath(path)
+		if not os.path.isdir(path):
+			yield path
+			continue
+
+		for root, dirs, files in os.walk(path):
+			dirs[:] = sorted(dir for dir in dirs if dir != '__pycache__')
+			for file in sorted(files):
+				if file.endswith('.py'):
+					yield os.path.join(root, file)
+
+def compile_one(path, **kwargs):
+	try:
+		compiled = _bytecode.compile_file(path, **kwargs)
+	except Exception as exc:
+		return CompileResult(path, False, exc)
+	return CompileResult(path, compiled, None)
+
+def iter_compile(paths, *, workers=None, **kwargs):
+	"""compile the given files and directories, yielding a CompileResult for each file in order.
+
+	workers is the number of processes to use, defaulting to the number of CPUs.
+	If it is 1, or there is only one file, the files are compiled in this process.
+	"""
+	paths = list(find_sources(paths))
+	compile = functools.partial(compile_one, **kwargs)
+
+	if workers is None:
+		workers = os.cpu_count() or 1
+	workers = min(workers, len(paths))
+	if workers <= 1:
+		yield from map(compile, paths)
+		return
+
+	with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+		yield from pool.map(compile, paths, chunksize=max(1, len(paths) // (workers * 4)))
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(
+		prog='import-expression -m compileall',
+		description='Write bytecode caches for Import Expression Python™ files, so that importing or running them is faster.',
+	)
+	parser.add_argument('paths', nargs='+', metavar='path', help='a file, or a directory to search recursively for .py files')
+	parser.add_argument('-f', '--force', action='store_true', help='recompile files even if their caches are up to date')
+	parser.add_argument(
+		'-j', '--workers', type=int, default=0,
+		help='the number of processes to compile with. The default, 0, uses one per CPU',
+	)
+	parser.add_argument(
+		'-o', '--optimize', type=int, default=-1, choices=[-1, 0, 1, 2],
+		help='the optimization level to compile with. The default, -1, uses that of the interpreter',
+	)
+	parser.add_argument(
+		'--invalidation-mode',
+		choices=sorted(mode.name.lower().replace('_', '-') for mode in _bytecode.PycInvalidationMode),
+		help=(
+			'how the bytecode caches are checked against their sources. '
+			'The default is "timestamp", or "checked-hash" if the SOURCE_DATE_EPOCH environment variable is set.'
+		),
+	)
+	parser.add_argument('-q', '--quiet', action='store_true', help='only print errors')
+	return parser.parse_args(argv)
+
+def main(argv=None):
+	args = parse_args(argv)
+
+	invalidation_mode = None
+	if args.invalidation_mode:
+		invalidation_mode = _bytecode.PycInvalidationMode[args.invalidation_mode.upper().replace('-', '_')]
+
+	compiled = skipped = failed = 0
+	for path, was_compiled, error in iter_compile(
+		args.paths,
+		workers=args.workers or None,
+		optimize=args.optimize,
+		invalidation_mode=invalidation_mode,
+		force=args.force,
+	):
+		if error is not None:
+			failed += 1
+			print(f'{path}: {type(error).__name__}: {error}', file=sys.stderr)
+		elif was_compiled:
+			compiled += 1
+			if not args.quiet:
+				print(f'Compiled {path}')
+		else:
+			skipped += 1
+
+	if not args.quiet:
+		print(f'{compiled} compiled, {skipped} up to date, {failed} failed')
+
+	return 1 if failed else 0
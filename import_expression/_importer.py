@@ -0,0 +1,104 @@
+# Copyright © io mintz <io@mintz.cc>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”),
+# to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import importlib.machinery
+import re
+import sys
+
+from . import compile
+
+# like a PEP 263 encoding declaration, this must be on the first or second line of the file
+MARKER_RE = re.compile(rb'^[ \t\f]*#.*?import[-_]expression[:=][ \t]*on\b', re.ASCII)
+
+class ImportExpressionLoader(importlib.machinery.SourceFileLoader):
+	"""A loader for Import Expression Python™ source files.
+
+	Bytecode is read from and written to __pycache__ just like for any other source file,
+	so importing an unchanged module costs the same as importing regular Python.
+	"""
+
+	def source_to_code(self, data, path, *, _optimize=-1):
+		return compile(data, path, 'exec', dont_inherit=True, optimize=_optimize, cache=False)
+
+class ImportExpressionFinder:
+	"""A meta path finder that loads some source files with :class:`ImportExpressionLoader`.
+
+	A module uses the loader if it is in one of the given packages (or is one of them),
+	or if marker is True and its source file has an "import-expression: on" comment in its first two lines.
+	"""
+
+	def __init__(self, packages=(), *, marker=False):
+		self.packages = frozenset(packages)
+		self.marker = marker
+
+	def __repr__(self):
+		return f'{type(self).__name__}(packages={sorted(self.packages)!r}, marker={self.marker!r})'
+
+	def _in_packages(self, fullname):
+		name = fullname
+		while name:
+			if name in self.packages:
+				return True
+			name = name.rpartition('.')[0]
+		return False
+
+	def find_spec(self, fullname, path=None, target=None):
+		in_packages = self._in_packages(fullname)
+		if not (in_packages or self.marker):
+			return None
+
+		spec = importlib.machinery.PathFinder.find_spec(fullname, path, target)
+		if spec is None or type(spec.loader) is not importlib.machinery.SourceFileLoader:
+			return spec
+
+		if in_packages or has_marker(spec.origin):
+			spec.loader = ImportExpressionLoader(fullname, spec.origin)
+
+		# if it doesn't opt in, the spec is the same as the one the regular path finder would return,
+		# so return it anyway to avoid searching sys.path again
+		return spec
+
+	def invalidate_caches(self):
+		pass
+
+def has_marker(path):
+	try:
+		with open(path, 'rb') as f:
+			lines = f.readline(), f.readline()
+	except OSError:
+		return False
+	return any(MARKER_RE.match(line) for line in lines)
+
+def install(packages=(), *, marker=False):
+	finder = ImportExpressionFinder(packages, marker=marker)
+	# insert just before the regular path finder so that built in and frozen modules are still found first
+	for i, other in enumerate(sys.meta_path):
+		if other is importlib.machinery.PathFinder:
+			break
+	else:
+		i = len(sys.meta_path)
+	sys.meta_path.insert(i, finder)
+	return finder
+
+def uninstall(finder=None):
+	sys.meta_path[:] = [
+		other for other in sys.meta_path
+		if not (other is finder or finder is None and isinstance(other, ImportExpressionFinder))
+	]
@@ -20,7 +20,10 @@
 # THE SOFTWARE.
 
 import ast
+import bisect
+import io
 import sys
+import tokenize
 import typing
 import functools
 import contextlib
@@ -38,19 +41,152 @@ SyntaxErrorContext = namedtuple('SyntaxErrorContext', _sec_fields)
 
 del _sec_fields
 
-def transform_ast(root_node, **kwargs): return ast.fix_missing_locations(Transformer(**kwargs).visit(root_node))
+# expression contexts carry no state, so like the parser, all new nodes share one
+_LOAD = ast.Load()
 
-def find_imports(root_node, **kwargs):
-	t = ListingTransformer(**kwargs)
-	t.visit(root_node)
+def transform_ast(root_node, *, marker_lines=None, **kwargs):
+	return Transformer(**kwargs).transform(root_node, marker_lines=marker_lines)
+
+def find_imports(root_node, *, positions=False, marker_lines=None, **kwargs):
+	t = ListingTransformer(positions=positions, **kwargs)
+	t.transform(root_node, marker_lines=marker_lines)
 	return t.imports
 
+def find_marker_lines(source) -> typing.Optional[typing.List[int]]:
+	"""return the sorted numbers of the lines of source that MARKER appears on, or None if that can't be told cheaply
+
+	Lines where MARKER is only in a string or a comment are included too, which is harmless.
+	"""
+	if isinstance(source, str):
+		marker, newline, cr, crlf = MARKER, '\n', '\r', '\r\n'
+	elif isinstance(source, bytes):
+		marker, newline, cr, crlf = MARKER.encode(), b'\n', b'\r', b'\r\n'
+	else:
+		return None
+
+	# a lone carriage return also ends a line as far as the parser is concerned
+	if source.count(cr) != source.count(crlf):
+		return None
+
+	lines = []
+	line = 1
+	last = 0
+	i = source.find(marker)
+	while i != -1:
+		line += source.count(newline, last, i)
+		if not lines or lines[-1] != line:
+			lines.append(line)
+		last = i
+		i = source.find(marker, i + len(marker))
+	return lines
+
 class Transformer(ast.NodeTransformer):
-	"""An AST transformer that replaces calls to MARKER with '__import__("importlib").import_module(...)'."""
+	"""An AST transformer that replaces calls to MARKER with '__import__("importlib").import_module(...)'.
+
+	If imports is one of the keys of IMPORT_HELPERS, they are replaced with calls to that helper instead.
+	For "instrumented", the helper is also passed the "line:column" of the import expression in the original source,
+	which requires calling find_markers on the tree first, unless the tree is transformed with the transform method.
+	"""
 
-	def __init__(self, *, filename=None, source=None):
+	def __init__(self, *, filename=None, source=None, imports='importlib'):
 		self.filename = filename
-		self.source_lines = source.splitlines() if source is not None else None
+		self.source = source
+		self.import_mode = imports
+		# line number -> column of each call to MARKER on that line, in the source that fix_syntax produced
+		self.marker_offsets = {}
+
+	@property
+	def source_lines(self):
+		"""the lines of the original source as str, which are only needed for errors and positions, so are split on demand"""
+		# not functools.cached_property, which before Python 3.12 holds a lock shared by every instance while computing
+		try:
+			return self._source_lines
+		except AttributeError:
+			pass
+		source = self.source
+		if source is None:
+			lines = None
+		else:
+			if not isinstance(source, str):
+				# in the encoding it declares, like the tokenizer reads it
+				source = bytes(source)
+				encoding, _ = tokenize.detect_encoding(io.BytesIO(source).readline)
+				source = source.decode(encoding, 'replace')
+			lines = source.splitlines()
+		self._source_lines = lines
+		return lines
+
+	def find_markers(self, root_node):
+		"""record the position of each call to MARKER, so that positions in the original source can be worked out"""
+		for node in self._find_marker_calls(root_node):
+			self.marker_offsets.setdefault(node.lineno, []).append(node.col_offset)
+
+	def transform(self, root_node, *, marker_lines=None):
+		"""Replace the calls to MARKER in the given tree in place, and return it.
+
+		Unlike visit, this only descends into statements that contain calls to MARKER, if marker_lines is given
+		(see find_marker_lines), and only gives the nodes it creates locations, rather than the whole tree.
+		"""
+		calls = self._find_marker_calls(root_node, marker_lines)
+		if self.needs_positions:
+			for node in calls:
+				self.marker_offsets.setdefault(node.lineno, []).append(node.col_offset)
+
+		for node in calls:
+			if self._is_import_expr(node):
+				self.transform_import_expr(node, self._collapse_attributes(node.args[0]), node.args[0].ctx)
+		return root_node
+
+	@property
+	def needs_positions(self) -> bool:
+		"""whether the positions of the import expressions in the original source are needed"""
+		return self.import_mode == 'instrumented'
+
+	@staticmethod
+	def _find_marker_calls(root_node, marker_lines=None) -> typing.List[ast.Call]:
+		"""return the calls to MARKER in the tree, in the order visit would find them"""
+		calls = []
+		stack = [root_node]
+		while stack:
+			node = stack.pop()
+			if marker_lines is not None and isinstance(node, ast.stmt):
+				decorators = getattr(node, 'decorator_list', None)
+				# decorators are the only part of a statement that come before its first line
+				start = decorators[0].lineno if decorators else node.lineno
+				i = bisect.bisect_left(marker_lines, start)
+				if i == len(marker_lines) or marker_lines[i] > node.end_lineno:
+					continue
+
+			if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == MARKER:
+				calls.append(node)
+			children = list(ast.iter_child_nodes(node))
+			children.reverse()
+			stack.extend(children)
+		return calls
+
+	@staticmethod
+	def _is_import_expr(node: ast.Call) -> bool:
+		return (
+			isinstance(node.func, ast.Name)
+			and node.func.id == MARKER
+			and len(node.args) == 1
+			and isinstance(node.args[0], (ast.Attribute, ast.Name))
+		)
+
+	def _original_position(self, node) -> str:
+		"""return "line:column" (both starting from 1) of the import expression that became the given MARKER call"""
+		return '{}:{}'.format(*self._original_location(node))
+
+	def _original_location(self, node) -> typing.Tuple[int, int]:
+		"""return the line and column (both starting from 1) of the import expression that became the given MARKER call"""
+		# each call to MARKER earlier in the line added MARKER + "(" before this one. Offsets are in UTF-8 bytes.
+		offset = node.col_offset - (len(MARKER) + 1) * sum(
+			col < node.col_offset for col in self.marker_offsets.get(node.lineno, ())
+		)
+		with contextlib.suppress(IndexError, TypeError):
+			line = self.source_lines[node.lineno - 1]
+			offset = len(line.encode('utf-8')[:offset].decode('utf-8', 'replace'))
+		return node.lineno, offset + 1
 
 	def _collapse_attributes(self, node: typing.Union[ast.Attribute, ast.Name]) -> str:
 		if isinstance(node, ast.Name):
@@ -71,31 +207,31 @@ class Transformer(ast.NodeTransformer):
 	def visit_Call(self, node: ast.Call) -> ast.AST:
 		"""Replace the import calls with a valid inline import expression."""
 
-		if (
-			isinstance(node.func, ast.Name)
-			and node.func.id == MARKER
-			and len(node.args) == 1
-			and isinstance(node.args[0], (ast.Attribute, ast.Name))
-		):
+		if self._is_import_expr(node):
 			identifier = self._collapse_attributes(node.args[0])
 			self.transform_import_expr(node, identifier, node.args[0].ctx)
 		return self.generic_visit(node)
 
 	def transform_import_expr(self, node, identifier, ctx):
-		node.func = ast.Attribute(
-			value=ast.Call(
-				func=ast.Name(id="__import__", ctx=ast.Load()),
-				args=[ast.Constant(value="importlib")],
+		marker, arg = node.func, node.args[0]
+		if self.import_mode in IMPORT_HELPERS:
+			node.func = ast.copy_location(ast.Name(id=IMPORT_HELPERS[self.import_mode], ctx=_LOAD), marker)
+		else:
+			import_call = ast.Call(
+				func=ast.copy_location(ast.Name(id="__import__", ctx=_LOAD), marker),
+				args=[ast.copy_location(ast.Constant(value="importlib"), marker)],
 				keywords=[],
-			),
-			attr="import_module",
-			ctx=ctx,
-		)
-		identifier = self._collapse_attributes(node.args[0])
-		self.import_hook(identifier)
-		node.args[0] = ast.Constant(value=identifier)
+			)
+			node.func = ast.copy_location(
+				ast.Attribute(value=ast.copy_location(import_call, marker), attr="import_module", ctx=ctx),
+				marker,
+			)
+		self.import_hook(identifier, node)
+		node.args[0] = ast.copy_location(ast.Constant(value=identifier), arg)
+		if self.import_mode == 'instrumented':
+			node.args.append(ast.copy_location(ast.Constant(value=self._original_position(node)), arg))
 
-	def import_hook(self, identifier):
+	def import_hook(self, identifier, node):
 		"""defined by subclasses"""
 		...
 
@@ -130,11 +266,23 @@ class Transformer(ast.NodeTransformer):
 		return SyntaxError(message, SyntaxErrorContext(**kwargs))
 
 class ListingTransformer(Transformer):
-	"""like the parent class but lists all imported modules as self.imports"""
+	"""like the parent class but lists all imported modules as self.imports
+
+	If positions is True, each module is listed as a (module, line, column) tuple instead,
+	which requires calling find_markers on the tree first.
+	"""
 
-	def __init__(self, *args, **kwargs):
+	def __init__(self, *args, positions=False, **kwargs):
 		super().__init__(*args, **kwargs)
+		self.positions = positions
 		self.imports = []
 
-	def import_hook(self, attribute_source):
-		self.imports.append(attribute_source)
+	@property
+	def needs_positions(self) -> bool:
+		return self.positions or super().needs_positions
+
+	def import_hook(self, attribute_source, node):
+		if self.positions:
+			self.imports.append((attribute_source, *self._original_location(node)))
+		else:
+			self.imports.append(attribute_source)
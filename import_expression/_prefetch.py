@@ -0,0 +1,64 @@
+# Copyright © io mintz <io@mintz.cc>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”),
+# to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import concurrent.futures
+import importlib
+import time
+from collections import namedtuple
+
+PrefetchResult = namedtuple('PrefetchResult', 'module seconds error')
+
+def _import_group(modules):
+	results = []
+	for module in modules:
+		start = time.perf_counter()
+		try:
+			importlib.import_module(module)
+		except Exception as exc:
+			error = exc
+		else:
+			error = None
+		results.append(PrefetchResult(module, time.perf_counter() - start, error))
+	return results
+
+def prefetch_modules(modules, *, max_workers=None):
+	"""import each of the given modules, returning a list of PrefetchResults in the order the modules were given
+
+	Modules are grouped by their top level package. Modules in the same group are imported in order on one thread,
+	and different groups are imported concurrently on a thread pool of at most max_workers threads.
+	Exceptions raised by an import are recorded in the result instead of being raised.
+	"""
+	groups = {}
+	for module in modules:
+		group = groups.setdefault(module.partition('.')[0], [])
+		if module not in group:
+			group.append(module)
+
+	if max_workers is None or max_workers > len(groups):
+		max_workers = len(groups)
+
+	if max_workers <= 1:
+		results = [result for group in groups.values() for result in _import_group(group)]
+	else:
+		with concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix='import_expression-prefetch') as pool:
+			results = [result for group in pool.map(_import_group, groups.values()) for result in group]
+
+	by_module = {result.module: result for result in results}
+	return [by_module[module] for module in dict.fromkeys(modules)]
@@ -0,0 +1,150 @@
+# Copyright © io mintz <io@mintz.cc>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”),
+# to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Optional timing of each stage of the compile pipeline.
+# When no profile is active, each instrumented stage costs one ContextVar lookup.
+
+import contextvars
+import threading
+import time
+from collections import namedtuple
+
+StageStats = namedtuple('StageStats', 'calls seconds peak')
+
+_current = contextvars.ContextVar('import_expression_profile', default=None)
+
+def active() -> bool:
+	"""return whether a profile is active, in which case each stage should run to completion on its own"""
+	return _current.get() is not None
+
+def run(stage, func, *args, **kwargs):
+	"""call func, recording it as the given stage in the active profile, if any"""
+	profile = _current.get()
+	if profile is None:
+		return func(*args, **kwargs)
+	return profile._run(stage, func, args, kwargs)
+
+class Profile:
+	"""Statistics about each stage of the compile pipeline run while this profile is active.
+
+	The stages are:
+	fast_path: trying builtins.compile on the source as is, in case it contains no import expressions
+	tokenize, transform_tokens, untokenize: the steps of fix_syntax
+	parse: ast.parse
+	transform: rewriting the import expressions in the AST
+	compile: builtins.compile
+
+	If callback is given, it is called as callback(stage, seconds, peak) after each stage.
+	peak is the peak memory in bytes allocated during the stage according to tracemalloc if memory is True,
+	otherwise None. Before Python 3.9, it may be lower than the real peak if an earlier stage's peak was higher.
+	"""
+
+	def __init__(self, callback=None, *, memory=False):
+		self.callback = callback
+		self.memory = memory
+		self._lock = threading.Lock()
+		# stage -> [calls, seconds, peak]
+		self._stats = {}
+
+	def __repr__(self):
+		return f'<{type(self).__name__} stages={self.stages!r}>'
+
+	@property
+	def stages(self):
+		"""a dict of stage name to a (calls, seconds, peak) named tuple, in the order the stages were first run.
+
+		seconds is the total time spent in the stage, and peak is the highest peak of any one call, or None.
+		"""
+		with self._lock:
+			return {stage: StageStats(*stats) for stage, stats in self._stats.items()}
+
+	@property
+	def seconds(self):
+		"""the total time spent in all stages"""
+		with self._lock:
+			return sum(seconds for calls, seconds, peak in self._stats.values())
+
+	def _run(self, stage, func, args, kwargs):
+		if self.memory:
+			# imported here because it's only needed when measuring memory, and importing it takes a while
+			import tracemalloc
+
+			# Python 3.9+
+			if hasattr(tracemalloc, 'reset_peak'):
+				tracemalloc.reset_peak()
+			baseline, baseline_peak = tracemalloc.get_traced_memory()
+
+		start = time.perf_counter()
+		try:
+			return func(*args, **kwargs)
+		finally:
+			seconds = time.perf_counter() - start
+			peak = None
+			if self.memory:
+				current, peak = tracemalloc.get_traced_memory()
+				if peak <= baseline_peak:
+					# without reset_peak, a peak from before the stage hides the stage's own,
+					# so the most that's known is how much of what it allocated is still allocated
+					peak = current
+				peak = max(0, peak - baseline)
+			self._record(stage, seconds, peak)
+
+	def _record(self, stage, seconds, peak):
+		with self._lock:
+			stats = self._stats.setdefault(stage, [0, 0.0, peak])
+			stats[0] += 1
+			stats[1] += seconds
+			if peak is not None:
+				stats[2] = max(stats[2], peak)
+
+		if self.callback is not None:
+			self.callback(stage, seconds, peak)
+
+class profile:
+	"""A context manager that records statistics about each stage of the compile pipeline run within it.
+
+	Entering it returns a :class:`Profile`, which is filled in as code is compiled.
+	See Profile for the meaning of the arguments.
+	Only compiles in the same context are recorded, so compiles in other threads or asyncio tasks are not.
+	If memory is True, tracemalloc is started (if it isn't already) until the context manager exits.
+	"""
+
+	def __init__(self, callback=None, *, memory=False):
+		self._profile = Profile(callback, memory=memory)
+		self._token = None
+		self._started_tracemalloc = False
+
+	def __enter__(self):
+		if self._profile.memory:
+			import tracemalloc
+
+			if not tracemalloc.is_tracing():
+				tracemalloc.start()
+				self._started_tracemalloc = True
+		self._token = _current.set(self._profile)
+		return self._profile
+
+	def __exit__(self, *excinfo):
+		_current.reset(self._token)
+		if self._started_tracemalloc:
+			import tracemalloc
+
+			tracemalloc.stop()
+			self._started_tracemalloc = False
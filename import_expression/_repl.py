@@ -0,0 +1,341 @@
+# Copyright © io mintz <io@mintz.cc>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”),
+# to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# This file primarily consists of code vendored from the CPython standard library.
+# It is used under the Python Software Foundation License Version 2.
+# See LICENSE for details.
+
+"""The REPL. Kept apart from __main__ so that running a file doesn't import it."""
+
+import __future__
+import builtins
+import code
+import codeop
+import contextlib
+import inspect
+import rlcompleter
+import sys
+import threading
+import types
+import warnings
+from codeop import PyCF_DONT_IMPLY_DEDENT, PyCF_ALLOW_INCOMPLETE_INPUT
+
+import import_expression
+from import_expression import constants
+from import_expression import _syntax
+
+features = [getattr(__future__, fname) for fname in __future__.all_feature_names]
+# what codeop expects compile to raise for incomplete input (Python 3.13+)
+_CompilerIncompleteInputError = getattr(builtins, '_IncompleteInputError', SyntaxError)
+
+class ImportExpressionCommandCompiler(codeop.CommandCompiler):
+	def __init__(self):
+		super().__init__()
+		self.compiler = ImportExpressionCompile()
+
+# this must be vendored as codeop.Compile is hardcoded to use builtins.compile
+class ImportExpressionCompile:
+	"""Instances of this class behave much like the built-in compile
+	function, but if one is used to compile text containing a future
+	statement, it "remembers" and compiles all subsequent program texts
+	with the statement in force."""
+	def __init__(self):
+		self.flags = PyCF_DONT_IMPLY_DEDENT | PyCF_ALLOW_INCOMPLETE_INPUT
+		# the console recompiles the whole buffer after each line, so only fix the lines added since the last time
+		self.fix_syntax = _syntax.IncrementalFixer()
+
+	def __call__(self, source, filename, symbol, **kwargs):
+		flags = self.flags
+		if kwargs.get('incomplete_input', True) is False:
+			flags &= ~PyCF_DONT_IMPLY_DEDENT
+			flags &= ~PyCF_ALLOW_INCOMPLETE_INPUT
+		try:
+			if constants.IMPORT_OP in source:
+				# import_expression.compile would first try compiling it as regular Python,
+				# which usually fails, and for incomplete input always does
+				codeob = import_expression._compile(
+					source, filename, symbol, flags, True, -1, engine='tokens', fast=False, fix_syntax=self.fix_syntax,
+				)
+			else:
+				codeob = compile(source, filename, symbol, flags, True)
+		except _syntax.IncompleteInputError as exc:
+			# unclosed brackets and strings are reported by the tokenizer, but codeop only recognizes the compiler's error:
+			# by its message before Python 3.13, and by its class since
+			if not flags & PyCF_ALLOW_INCOMPLETE_INPUT:
+				raise
+			raise _CompilerIncompleteInputError('incomplete input', (exc.filename, exc.lineno, exc.offset, exc.text)) from None
+		for feature in features:
+			if codeob.co_flags & feature.compiler_flag:
+				self.flags |= feature.compiler_flag
+		return codeob
+
+class ImportExpressionInteractiveConsole(code.InteractiveConsole):
+	def __init__(self, locals=None, filename='<console>'):
+		super().__init__(locals, filename)
+		self.compile = ImportExpressionCommandCompiler()
+
+# we must vendor this class because it creates global variables that the main code depends on
+class ImportExpressionAsyncIOInteractiveConsole(ImportExpressionInteractiveConsole):
+	def __init__(self, locals, loop):
+		import asyncio
+		from ast import PyCF_ALLOW_TOP_LEVEL_AWAIT
+
+		super().__init__(locals)
+		self.loop = loop
+		self.locals.update(dict(asyncio=asyncio, loop=loop))
+		self.compile.compiler.flags |= PyCF_ALLOW_TOP_LEVEL_AWAIT
+
+		self.loop = loop
+		self._source = None
+
+	def runsource(self, source, *args, **kwargs):
+		self._source = source
+		try:
+			return super().runsource(source, *args, **kwargs)
+		finally:
+			self._source = None
+
+	def runcode(self, code):
+		import concurrent.futures
+		from asyncio import futures
+
+		# import the modules the code needs here on the REPL's thread, so that the event loop, which is running
+		# the tasks started earlier, doesn't stop for them. Errors are raised when the code runs, as usual.
+		if self._source is not None and constants.IMPORT_OP in self._source:
+			with contextlib.suppress(SyntaxError):
+				import_expression.prefetch(self._source, self.filename, 'single', max_workers=1)
+
+		future = concurrent.futures.Future()
+
+		def callback():
+			global repl_future
+			global repl_future_interrupted
+
+			repl_future = None
+			repl_future_interrupted = False
+
+			func = types.FunctionType(code, self.locals)
+			try:
+				coro = func()
+			except SystemExit:
+				raise
+			except KeyboardInterrupt as ex:
+				repl_future_interrupted = True
+				future.set_exception(ex)
+				return
+			except BaseException as ex:
+				future.set_exception(ex)
+				return
+
+			if not inspect.iscoroutine(coro):
+				future.set_result(coro)
+				return
+
+			try:
+				repl_future = self.loop.create_task(coro)
+				futures._chain_future(repl_future, future)
+			except BaseException as exc:
+				future.set_exception(exc)
+
+		self.loop.call_soon_threadsafe(callback)
+
+		try:
+			return future.result()
+		except SystemExit:
+			raise
+		except BaseException:
+			if repl_future_interrupted:
+				self.write("\nKeyboardInterrupt\n")
+			else:
+				self.showtraceback()
+
+class REPLThread(threading.Thread):
+	def __init__(self, interact_kwargs):
+		self.interact_kwargs = interact_kwargs
+		super().__init__()
+
+	def run(self):
+		try:
+			console.interact(**self.interact_kwargs)
+		finally:
+			warnings.filterwarnings(
+				'ignore',
+				message=r'^coroutine .* was never awaited$',
+				category=RuntimeWarning,
+			)
+
+			loop.call_soon_threadsafe(loop.stop)
+
+class ImportExpressionCompleter(rlcompleter.Completer):
+	"""Tab completion for the REPL, including of the attributes of modules in import expressions.
+
+	Modules that aren't imported yet are imported on a background thread.
+	If that takes longer than timeout seconds, nothing is completed, and the import carries on,
+	so that pressing Tab again once it's done completes straight away.
+	The completions of each import expression are cached until sys.modules changes.
+	"""
+
+	# the number of completions to cache
+	cache_size = 256
+
+	def __init__(self, namespace=None, *, timeout=constants.DEFAULT_COMPLETION_TIMEOUT):
+		super().__init__(namespace)
+		self.timeout = timeout
+		# module name -> Future of the top level module, which is what __import__ returns
+		self._imports = {}
+		# text -> (the module it completes the attributes of, the completions)
+		self._cache = {}
+		self._modules_count = len(sys.modules)
+
+	def attr_matches(self, text):
+		# hack to help ensure valid syntax
+		mod_names = import_expression.find_imports(text.rstrip().rstrip('.'), engine='tokens')
+		if not mod_names:
+			return super().attr_matches(text)
+		mod_name = mod_names[0]
+
+		# importing a module adds attributes to its parent package, and usually adds other modules too
+		if len(sys.modules) != self._modules_count:
+			self._modules_count = len(sys.modules)
+			self._cache.clear()
+			self._imports = {name: future for name, future in self._imports.items() if not future.done()}
+
+		try:
+			module, matches = self._cache[text]
+		except KeyError:
+			pass
+		else:
+			if sys.modules.get(mod_name) is module:
+				return matches
+
+		top_level_module = self._import(mod_name)
+		if top_level_module is None:
+			return []
+
+		matches = self._module_attr_matches(text, mod_name, top_level_module)
+		if len(self._cache) >= self.cache_size:
+			del self._cache[next(iter(self._cache))]
+		self._cache[text] = sys.modules.get(mod_name), matches
+		return matches
+
+	def _import(self, mod_name):
+		"""return what __import__(mod_name) does, or None if it failed or didn't finish within the timeout"""
+		import concurrent.futures
+
+		try:
+			future = self._imports[mod_name]
+		except KeyError:
+			module = sys.modules.get(mod_name)
+			# modules that are still being imported are in sys.modules too, and importing them blocks until they're done
+			if module is not None and not getattr(getattr(module, '__spec__', None), '_initializing', False):
+				with contextlib.suppress(Exception):
+					return __import__(mod_name)
+
+			future = self._imports[mod_name] = concurrent.futures.Future()
+			# a daemon thread, so that an import that hangs doesn't stop the REPL from exiting
+			threading.Thread(target=self._run_import, args=(mod_name, future), daemon=True).start()
+
+		try:
+			return future.result(self.timeout)
+		except concurrent.futures.TimeoutError:
+			return None
+		except Exception:
+			# not retried until sys.modules changes
+			return None
+
+	@staticmethod
+	def _run_import(mod_name, future):
+		# __import__ is used instead of importlib.import_module
+		# because __import__ is designed for updating module-level globals, which we are doing.
+		# Specifically, __import__('x.y') returns x, which is necessary for tab completion.
+		try:
+			module = __import__(mod_name)
+		except BaseException as exc:
+			future.set_exception(exc)
+		else:
+			future.set_result(module)
+
+	def _module_attr_matches(self, text, mod_name, top_level_module):
+		mod_name_with_import_op = mod_name + constants.IMPORT_OP
+		# don't import the module in our current namespace, otherwise tab completion would also have side effects
+		old_namespace = self.namespace
+		self.namespace = {top_level_module.__name__: top_level_module}
+		try:
+			return [
+				# this is a hack because it also replaces non-identifiers
+				# however, readline / rlcompleter only operates on identifiers so it's OK i guess
+				# we need to replace so that the tab completions all have the correct prefix
+				match.replace(mod_name, mod_name_with_import_op, 1)
+				for match
+				in super().attr_matches(text.replace(mod_name_with_import_op, mod_name))
+			]
+		finally:
+			self.namespace = old_namespace
+
+def asyncio_main(repl_locals, interact_kwargs):
+	global console
+	global loop
+	global repl_future
+	global repl_future_interrupted
+
+	import asyncio
+
+	loop = asyncio.get_event_loop()
+
+	console = ImportExpressionAsyncIOInteractiveConsole(repl_locals, loop)
+
+	repl_future = None
+	repl_future_interrupted = False
+
+	repl_thread = REPLThread(interact_kwargs)
+	repl_thread.daemon = True
+	repl_thread.start()
+
+	while True:
+		try:
+			loop.run_forever()
+		except KeyboardInterrupt:
+			if repl_future and not repl_future.done():
+				repl_future.cancel()
+				repl_future_interrupted = True
+			continue
+		else:
+			break
+
+def setup_history_and_tab_completion(locals, *, completion_timeout=constants.DEFAULT_COMPLETION_TIMEOUT):
+	try:
+		import readline
+		import site
+		import rlcompleter
+	except ImportError:
+		# readline is not available on all platforms
+		return
+
+	try:
+		# set up history
+		sys.__interactivehook__()
+	except AttributeError:
+		# site has not set __interactivehook__ because python was run without site packages
+		return
+
+	# allow completion of text containing an import op (otherwise it is treated as a word boundary)
+	readline.set_completer_delims(readline.get_completer_delims().replace(constants.IMPORT_OP, ''))
+	# inform tab completion of what variables were set at the REPL
+	readline.set_completer(ImportExpressionCompleter(locals, timeout=completion_timeout).complete)
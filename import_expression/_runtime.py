@@ -0,0 +1,172 @@
+# Copyright © io mintz <io@mintz.cc>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”),
+# to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Helpers called by code compiled with the imports= argument.
+# They're added to builtins so that compiled code can find them no matter what globals it runs with.
+
+import builtins
+import sys
+import threading
+import time
+from importlib import import_module as _import_module
+
+from .constants import *
+
+def import_module(name):
+	"""Equivalent to importlib.import_module(name), but faster for modules that have already been imported.
+
+	name must be absolute.
+	"""
+	try:
+		module = sys.modules[name]
+	except KeyError:
+		return _import_module(name)
+
+	# _initializing means another thread may still be executing the module, and None means the import is blocked.
+	# The import system knows what to do in both cases.
+	try:
+		if module.__spec__._initializing:
+			return _import_module(name)
+	except AttributeError:
+		if module is None:
+			return _import_module(name)
+
+	return module
+
+_lazy_lock = threading.Lock()
+
+def lazy_import_module(name):
+	"""Import a module such that its code only runs the first time one of its attributes is accessed.
+
+	Parent packages are imported eagerly, as they are needed to find the module.
+	Modules that are already imported are returned as is,
+	and modules that importlib.util.LazyLoader doesn't support are imported eagerly:
+	built in, frozen, and extension modules, namespace packages, and modules that use other kinds of loaders.
+	"""
+	if name in sys.modules:
+		return import_module(name)
+
+	import importlib.machinery
+	import importlib.util
+
+	# this imports the parent packages, so it must not be done while holding the lock
+	spec = importlib.util.find_spec(name)
+	if spec is None:
+		raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+
+	if not isinstance(spec.loader, (importlib.machinery.SourceFileLoader, importlib.machinery.SourcelessFileLoader)):
+		return _import_module(name)
+
+	with _lazy_lock:
+		if name in sys.modules:
+			return import_module(name)
+
+		loader = importlib.util.LazyLoader(spec.loader)
+		spec.loader = loader
+		module = importlib.util.module_from_spec(spec)
+		sys.modules[name] = module
+		loader.exec_module(module)
+
+		# like the import system, make submodules available as attributes of their parent
+		parent, _, child = name.rpartition('.')
+		if parent:
+			setattr(sys.modules[parent], child, module)
+
+		return module
+
+_stats_lock = threading.Lock()
+# (filename, "line:column", module name) -> [hits, hit seconds, misses, miss seconds]
+_stats = {}
+
+def instrumented_import_module(name, position):
+	"""Equivalent to importlib.import_module(name), but records how often and how long it took, per call site.
+
+	position is the "line:column" of the import expression in the file that the calling code was compiled from.
+	Calls where the module was already in sys.modules are counted as hits, and the rest as misses.
+	"""
+	hit = sys.modules.get(name) is not None
+	start = time.perf_counter()
+	try:
+		return _import_module(name)
+	finally:
+		seconds = time.perf_counter() - start
+		key = (sys._getframe(1).f_code.co_filename, position, name)
+		with _stats_lock:
+			stats = _stats.get(key)
+			if stats is None:
+				stats = _stats[key] = [0, 0.0, 0, 0.0]
+			if hit:
+				stats[0] += 1
+				stats[1] += seconds
+			else:
+				stats[2] += 1
+				stats[3] += seconds
+
+def import_stats():
+	with _stats_lock:
+		items = [(key, list(stats)) for key, stats in _stats.items()]
+
+	result = {}
+	for (filename, position, name), (hits, hit_seconds, misses, miss_seconds) in items:
+		result.setdefault(f'{filename}:{position}', {})[name] = dict(
+			calls=hits + misses,
+			hits=hits,
+			hit_seconds=hit_seconds,
+			misses=misses,
+			miss_seconds=miss_seconds,
+		)
+	return result
+
+def import_stats_clear():
+	with _stats_lock:
+		_stats.clear()
+
+def _label_value(value):
+	return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def import_stats_openmetrics(prefix='import_expression'):
+	lines = []
+	stats = import_stats()
+	for metric, help, fields in (
+		('imports', 'Number of times an import expression was evaluated.', dict(hit='hits', miss='misses')),
+		('import_seconds', 'Time spent evaluating an import expression.', dict(hit='hit_seconds', miss='miss_seconds')),
+	):
+		name = f'{prefix}_{metric}'
+		lines.append(f'# TYPE {name} counter')
+		if metric == 'import_seconds':
+			lines.append(f'# UNIT {name} seconds')
+		lines.append(f'# HELP {name} {help}')
+		for site, modules in stats.items():
+			for module, counters in modules.items():
+				for result, field in fields.items():
+					labels = f'site="{_label_value(site)}",module="{_label_value(module)}",result="{result}"'
+					lines.append(f'{name}_total{{{labels}}} {counters[field]}')
+	lines.append('# EOF')
+	return '\n'.join(lines) + '\n'
+
+HELPERS = {
+	'cached': import_module,
+	'lazy': lazy_import_module,
+	'instrumented': instrumented_import_module,
+}
+
+def install():
+	for imports, helper in HELPERS.items():
+		setattr(builtins, IMPORT_HELPERS[imports], helper)
@@ -0,0 +1,210 @@
+# Copyright © io mintz <io@mintz.cc>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”),
+# to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Finding the modules imported by whole directory trees of Import Expression Python™.
+
+import argparse
+import concurrent.futures
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+from collections import namedtuple
+
+from ._compileall import find_sources
+from ._bytecode import write_atomic
+from .version import __version__
+
+ScanResult = namedtuple('ScanResult', 'path imports error')
+
+# bump this when the format of the cache files changes
+_CACHE_FORMAT = 1
+
+class ScanCache:
+	"""The imports found in each file scanned, and what is needed to tell whether the file has changed since.
+
+	A file whose modification time and size are unchanged is assumed to be unchanged.
+	Otherwise, if its size is unchanged, its contents are hashed and compared, so that touching a file
+	doesn't require scanning it again.
+
+	If path is given, the cache is loaded from that file, and save() writes it back.
+	Caches written by other versions of import_expression are ignored, as they may have found different imports.
+	"""
+
+	def __init__(self, path=None):
+		self.path = path
+		# absolute path -> [mtime_ns, size, digest, [[module, line, column], ...]]
+		self.entries = {}
+		if path is not None:
+			self.load()
+
+	def load(self):
+		try:
+			with open(self.path, 'rb') as f:
+				data = json.load(f)
+		except (OSError, ValueError):
+			return
+
+		if isinstance(data, dict) and data.get('format') == _CACHE_FORMAT and data.get('version') == __version__:
+			self.entries = data['files']
+
+	def save(self):
+		data = {'format': _CACHE_FORMAT, 'version': __version__, 'files': self.entries}
+		write_atomic(os.path.abspath(self.path), json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+	def get(self, path):
+		"""return the imports of the file at path if they are cached and it hasn't changed since, otherwise None"""
+		path = os.path.abspath(path)
+		try:
+			entry = self.entries[path]
+			stats = os.stat(path)
+		except (KeyError, OSError):
+			return None
+
+		mtime_ns, size, digest, imports = entry
+		if stats.st_size != size:
+			return None
+		if stats.st_mtime_ns != mtime_ns:
+			try:
+				with open(path, 'rb') as f:
+					data = f.read()
+			except OSError:
+				return None
+			if _digest(data) != digest:
+				return None
+			entry[0] = stats.st_mtime_ns
+
+		return [tuple(import_) for import_ in imports]
+
+	def put(self, path, stamp, imports):
+		"""record the imports of the file at path, whose stamp is the (mtime_ns, size, digest) it had when scanned"""
+		self.entries[os.path.abspath(path)] = [*stamp, [list(import_) for import_ in imports]]
+
+def _digest(data):
+	return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def scan_file(path):
+	"""return the ScanResult of the file at path, and the stamp to cache it under (None on error)"""
+	from . import find_imports
+
+	try:
+		with open(path, 'rb') as f:
+			stats = os.fstat(f.fileno())
+			data = f.read()
+		source = importlib.util.decode_source(data)
+		imports = find_imports(source, path, positions=True)
+	except Exception as exc:
+		return ScanResult(path, [], exc), None
+	return ScanResult(path, imports, None), (stats.st_mtime_ns, stats.st_size, _digest(data))
+
+def iter_scan(paths, *, workers=None, cache=None):
+	"""find the imports of the given files and directories, yielding a ScanResult for each file in order.
+
+	workers is the number of processes to use, defaulting to the number of CPUs.
+	If it is 1, or there is at most one file to scan, the files are scanned in this process.
+	cache is a ScanCache, or the path of a file to keep one in, which is updated once the generator finishes.
+	Only files that aren't in the cache or have changed since are scanned.
+	"""
+	if cache is not None and not isinstance(cache, ScanCache):
+		cache = ScanCache(cache)
+
+	paths = list(find_sources(paths))
+	cached = [cache.get(path) if cache is not None else None for path in paths]
+	to_scan = [path for path, imports in zip(paths, cached) if imports is None]
+
+	if workers is None:
+		workers = os.cpu_count() or 1
+	workers = min(workers, len(to_scan))
+
+	pool = None
+	try:
+		if workers <= 1:
+			scanned = map(scan_file, to_scan)
+		else:
+			pool = concurrent.futures.ProcessPoolExecutor(workers)
+			scanned = pool.map(scan_file, to_scan, chunksize=max(1, len(to_scan) // (workers * 4)))
+
+		for path, imports in zip(paths, cached):
+			if imports is not None:
+				yield ScanResult(path, imports, None)
+				continue
+
+			result, stamp = next(scanned)
+			if cache is not None and stamp is not None:
+				cache.put(path, stamp, result.imports)
+			yield result
+	finally:
+		if pool is not None:
+			# don't wait for the rest of the files to be scanned if the caller stopped early
+			pool.shutdown(**{'cancel_futures': True} if sys.version_info >= (3, 9) else {})
+		if cache is not None and cache.path is not None:
+			cache.save()
+
+def index(results):
+	"""return a dict of each module imported in the given ScanResults to a sorted list of (path, line, column)"""
+	index = {}
+	for path, imports, _ in results:
+		for module, line, column in imports:
+			index.setdefault(module, set()).add((path, line, column))
+	return {module: sorted(locations) for module, locations in sorted(index.items())}
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(
+		prog='import-expression -m scan',
+		description='List the modules imported by the import expressions in Import Expression Python™ files.',
+	)
+	parser.add_argument('paths', nargs='+', metavar='path', help='a file, or a directory to search recursively for .py files')
+	parser.add_argument(
+		'-j', '--workers', type=int, default=0,
+		help='the number of processes to scan with. The default, 0, uses one per CPU',
+	)
+	parser.add_argument(
+		'--cache', metavar='file',
+		help='a file to keep the imports of each file in, so that scanning again only scans the files that changed',
+	)
+	parser.add_argument(
+		'--json', action='store_true',
+		help='print a JSON object of each module to a list of the [path, line, column] it is imported at',
+	)
+	return parser.parse_args(argv)
+
+def main(argv=None):
+	args = parse_args(argv)
+
+	failed = 0
+	def results():
+		nonlocal failed
+		for result in iter_scan(args.paths, workers=args.workers or None, cache=args.cache):
+			if result.error is not None:
+				failed += 1
+				print(f'{result.path}: {type(result.error).__name__}: {result.error}', file=sys.stderr)
+			yield result
+
+	imports = index(results())
+	if args.json:
+		json.dump(imports, sys.stdout)
+		print()
+	else:
+		for module, locations in imports.items():
+			for path, line, column in locations:
+				print(f'{module}\t{path}:{line}:{column}')
+
+	return 1 if failed else 0
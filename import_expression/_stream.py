@@ -0,0 +1,144 @@
+# Copyright © io mintz <io@mintz.cc>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”),
+# to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Evaluating an expression once per line of input, like awk, for the -e option of the import-expression command.
+
+import collections
+import concurrent.futures
+import itertools
+
+from . import compile, compile_function, exec
+from .constants import *
+
+class LineProcessor:
+	"""Evaluates an expression for each line in a batch of lines, returning what should be written for them.
+
+	The expression is compiled once to a function of line, without its separator, and n, the line number,
+	counting from 1. Results that aren't None are written, one per line.
+	If filter is True, the lines themselves are written instead, for each one that the expression is true for.
+	begin is code that's run once in the expression's globals, before anything else.
+	"""
+
+	def __init__(self, expression, *, filter=False, begin=None, separator='\n'):
+		self.globals = {}
+		if begin is not None:
+			exec(compile(begin, '<begin>', imports='cached'), self.globals)
+		self.function = compile_function(expression, 'line, n', '<expression>', globals=self.globals)
+		self.filter = filter
+		self.separator = separator
+
+	def process(self, lines, start):
+		"""return the output for the given lines, the first of which is line number start"""
+		function = self.function
+		separator = self.separator
+		output = []
+		append = output.append
+		for n, line in enumerate(lines, start):
+			if line.endswith(separator):
+				line = line[:-len(separator)]
+			result = function(line, n)
+			if self.filter:
+				if result:
+					append(line)
+			elif result is not None:
+				append(str(result))
+
+		if not output:
+			return ''
+		output.append('')
+		return separator.join(output)
+
+def iter_batches(file, batch_size, separator='\n'):
+	"""yield lists of at most batch_size lines read from file, each including its separator except perhaps the last"""
+	if separator == '\n':
+		# newlines are what text files already split on
+		while True:
+			batch = list(itertools.islice(file, batch_size))
+			if not batch:
+				return
+			yield batch
+
+	batch = []
+	rest = ''
+	while True:
+		chunk = file.read(STREAM_CHUNK_SIZE)
+		if not chunk:
+			break
+		lines = (rest + chunk).split(separator)
+		rest = lines.pop()
+		for line in lines:
+			batch.append(line + separator)
+			if len(batch) == batch_size:
+				yield batch
+				batch = []
+	if rest:
+		batch.append(rest)
+	if batch:
+		yield batch
+
+_processor = None
+
+def _init_worker(expression, kwargs):
+	global _processor
+	_processor = LineProcessor(expression, **kwargs)
+
+def _process(lines, start):
+	return _processor.process(lines, start)
+
+def run(
+	expression, input, output, *,
+	filter=False, begin=None, end=None, separator='\n', batch_size=DEFAULT_STREAM_BATCH_SIZE, workers=1,
+):
+	"""evaluate expression for each line of the file input, writing the results to the file output
+
+	See LineProcessor for what's written. end is code that's run once in the expression's globals after the last line.
+	Lines are read and processed batch_size at a time, and each batch's output is written with one call.
+	If workers is more than 1, batches are processed on that many processes, and their output is written in order.
+	Each process then has its own globals, and runs begin itself, so begin should only set up,
+	and end only sees what begin did in this process.
+	"""
+	kwargs = dict(filter=filter, begin=begin, separator=separator)
+	# this also reports errors in the expression and begin before any input is read
+	processor = LineProcessor(expression, **kwargs)
+
+	batches = iter_batches(input, batch_size, separator)
+	start = 1
+	if workers <= 1:
+		for batch in batches:
+			output.write(processor.process(batch, start))
+			start += len(batch)
+	else:
+		with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(expression, kwargs)) as pool:
+			# enough batches in flight to keep every worker busy, without reading the whole input ahead
+			pending = collections.deque()
+			try:
+				for batch in batches:
+					pending.append(pool.submit(_process, batch, start))
+					start += len(batch)
+					if len(pending) >= workers * 2:
+						output.write(pending.popleft().result())
+				while pending:
+					output.write(pending.popleft().result())
+			finally:
+				for future in pending:
+					future.cancel()
+
+	if end is not None:
+		exec(compile(end, '<end>', imports='cached'), processor.globals)
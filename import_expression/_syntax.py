@@ -23,130 +23,394 @@
 # It is used under the Python Software Foundation License Version 2.
 # See LICENSE for details.
 
-import io
 import re
+import functools
+import keyword
 import sys
 import string
 import typing
 import collections
 from token import *
 from .constants import *
+from . import _profiling
 import tokenize as tokenize_
 
 T = typing.TypeVar("T")
 
-def fix_syntax(s: typing.AnyStr, filename=DEFAULT_FILENAME) -> bytes:
+# the most common form of inline import expression, "module!.attribute"
+_LIKELY_RE = re.compile(r'\w' + re.escape(IMPORT_OP) + r'\.')
+_LIKELY_BYTES_RE = re.compile(_LIKELY_RE.pattern.encode())
+# unlike the in operator, regular expressions can search any bytes-like object, including memoryviews
+_MARKER_BYTES_RE = re.compile(re.escape(MARKER.encode()))
+# `in` only searches for substrings in str and bytes, not in other bytes-like objects such as memoryviews
+_IMPORT_OP_BYTES_RE = re.compile(re.escape(IMPORT_OP.encode()))
+
+def likely_contains_import_exprs(s: typing.AnyStr) -> bool:
+	"""Quickly guess whether the given source code contains an inline import expression.
+
+	This is only a heuristic, used to decide whether to try compiling the source as regular Python first.
+	A wrong guess only costs time: source that contains an import expression is never valid Python,
+	and source that is valid Python has nothing for fix_syntax to transform (apart from explicit calls to MARKER).
+	"""
+	if isinstance(s, str):
+		return MARKER in s or _LIKELY_RE.search(s) is not None
+	return _MARKER_BYTES_RE.search(s) is not None or _LIKELY_BYTES_RE.search(s) is not None
+
+def fix_syntax(s: typing.AnyStr, filename=DEFAULT_FILENAME, *, direct=False, imports='importlib') -> typing.AnyStr:
+	"""Convert Import Expression Python™ to Python source code.
+
+	By default, inline import expressions are wrapped in calls to MARKER, for the AST transformer to replace later.
+	If direct is True, they are replaced with the final import calls, so that the result can be compiled as is.
+
+	s may be a str, or any bytes-like object, such as a memoryview or an mmap. Given a str, this returns a str.
+	Otherwise, it returns bytes in the encoding of the source code, keeping its encoding declaration,
+	which compile and ast.parse accept as is.
+	"""
+	tokens, _ = tokenize(s)
+	if _profiling.active():
+		# each stage has to run to completion on its own to be timed
+		tokens = _profiling.run('tokenize', _read_tokens, tokens, s, filename)
+		transformed = _profiling.run('transform_tokens', transform_tokens, tokens, direct=direct, imports=imports)
+	else:
+		# otherwise, stream the tokens through, so that only a few of them are held in memory at once
+		transformed = iter_transform_tokens(_iter_tokens(tokens, s, filename), direct=direct, imports=imports)
+	return _profiling.run('untokenize', tokenize_.untokenize, transformed)
+
+class IncompleteInputError(SyntaxError):
+	"""Raised instead of SyntaxError when the source code ends in the middle of a string or a bracketed expression."""
+
+def _read_tokens(tokens, s, filename, *, line_offset=0) -> typing.List[tokenize_.TokenInfo]:
+	"""Return a list of the given tokens of the source code s, converting tokenizer errors to SyntaxErrors.
+
+	line_offset is added to the line numbers of errors.
+	"""
+	return list(_iter_tokens(tokens, s, filename, line_offset=line_offset))
+
+def _iter_tokens(tokens, s, filename, *, line_offset=0) -> typing.Iterator[tokenize_.TokenInfo]:
+	"""Like _read_tokens, but yield each token as it is read."""
+	# the tokenize module also reports unmatched closing brackets as "EOF in multi-line statement",
+	# so keep track of whether there were any
+	depth = 0
+	brackets_match = True
 	try:
-		tokens, encoding = tokenize(s)
-		tokens = list(tokens)
+		for tok in tokens:
+			if tok.type == tokenize_.OP:
+				if tok.string in '([{':
+					depth += 1
+				elif tok.string in ')]}':
+					depth -= 1
+					brackets_match = brackets_match and depth >= 0
+			yield tok
 	except tokenize_.TokenError as ex:
 		message, (lineno, offset) = ex.args
+		lineno += line_offset
+		# before Python 3.12, the pure Python tokenizer reports unclosed brackets on the line after the last one,
+		# and unclosed strings where they start, like the C tokenizer used since does for both
+		if sys.version_info < (3, 12) and message == 'EOF in multi-line statement':
+			lineno -= 1
 
-		try:
-			source_line = s.splitlines()[lineno-2]
-		except IndexError:
-			source_line = None
+		source_line = get_line(s, lineno)
 
-		raise SyntaxError(message, (filename, lineno-1, offset, source_line)) from None
+		# "EOF in multi-line ..." before Python 3.12, and "unexpected EOF in multi-line statement" since
+		cls = IncompleteInputError if 'EOF in multi-line' in message and brackets_match else SyntaxError
+		raise cls(message, (filename, lineno, offset, source_line)) from None
 
-	transformed = transform_tokens(tokens)
-	return tokenize_.untokenize(transformed).decode(encoding)
+class IncrementalFixer:
+	"""A replacement for fix_syntax for source code that is usually extended at the end between calls,
+	such as the input buffer of the REPL, which is recompiled after every line that is entered.
 
-def offset_token_horizontal(tok: tokenize_.TokenInfo, offset: int) -> tokenize_.TokenInfo:
-	"""Takes a token and returns a new token with the columns for start and end offset by a given amount."""
+	Once a logical line is complete, its tokens are transformed and the result is kept,
+	so that later calls only tokenize and transform what comes after it.
+	Any source that doesn't start with the previously seen complete lines starts over from scratch.
+	"""
+
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		self._options = None
+		# the complete logical lines seen so far, and what they were fixed to
+		self._source = ''
+		self._fixed = ''
+		self._lines = 0
+		# the indentation of each block that is still open at the end of _source
+		self._indents = []
+
+	def __call__(self, s: typing.AnyStr, filename=DEFAULT_FILENAME, *, direct=False, imports='importlib') -> str:
+		# the positions given to the instrumented helper would be relative to where tokenizing started
+		if not isinstance(s, str) or imports == 'instrumented':
+			return fix_syntax(s, filename, direct=direct, imports=imports)
+
+		options = (direct, imports)
+		if options != self._options or not s.startswith(self._source):
+			self.reset()
+			self._options = options
+
+		# tokenize the rest of the source behind a header that opens the same blocks,
+		# so that the tokenizer is in the same state as it was at the end of _source.
+		# It starts with an unindented line because untokenize only indents lines that follow a NEWLINE token.
+		header_lines = ['pass\n'] + [indent + 'pass\n' for indent in self._indents]
+		header = ''.join(header_lines)
+		rest = s[len(self._source):]
+		try:
+			tokens = _profiling.run(
+				'tokenize',
+				_read_tokens,
+				tokenize_.generate_tokens(readline(header + rest)),
+				s,
+				filename,
+				line_offset=self._lines - len(header_lines),
+			)
+		except IncompleteInputError:
+			raise
+		except SyntaxError:
+			# e.g. inconsistent indentation. Let fix_syntax report it with the right line number.
+			return fix_syntax(s, filename, direct=direct, imports=imports)
+
+		transformed = _profiling.run('transform_tokens', transform_tokens, tokens, direct=direct, imports=imports)
+		fixed = _profiling.run('untokenize', tokenize_.untokenize, transformed)
+		if not fixed.startswith(header):
+			return fix_syntax(s, filename, direct=direct, imports=imports)
+		fixed = fixed[len(header):]
+
+		result = self._fixed + fixed
+		self._checkpoint(tokens, rest, fixed, header_lines=len(header_lines))
+		return result
+
+	def _checkpoint(self, tokens, rest, fixed, *, header_lines):
+		# find the last logical line that ended with an actual newline (rather than the end of the input)
+		# and the blocks open at that point
+		indents = []
+		last_row = header_lines
+		for tok in tokens:
+			if tok.type == tokenize_.INDENT:
+				indents.append(tok.string)
+			elif tok.type == tokenize_.DEDENT:
+				indents.pop()
+			elif tok.type == tokenize_.NEWLINE and tok.string.endswith('\n'):
+				last_row = tok.start[0]
+				checkpoint_indents = indents.copy()
+
+		# the fixed code has the same line breaks as the source
+		n_lines = last_row - header_lines
+		if n_lines <= 0:
+			return
+
+		self._source += _first_lines(rest, n_lines)
+		self._fixed += _first_lines(fixed, n_lines)
+		self._lines += n_lines
+		self._indents = checkpoint_indents
+
+def _first_lines(s, n):
+	end = 0
+	for _ in range(n):
+		end = s.index('\n', end) + 1
+	return s[:end]
+
+def offset_token_horizontal(tok: tokenize_.TokenInfo, offset: int, *, line: int) -> tokenize_.TokenInfo:
+	"""Takes a token and returns a new token with the columns on the given line offset by a given amount.
+
+	Only the start or the end column is changed if the token spans multiple lines.
+	"""
 
 	start_row, start_col = tok.start
 	end_row, end_col = tok.end
-	return tok._replace(start=(start_row, start_col + offset), end=(end_row, end_col + offset))
-
-def offset_line_horizontal(
-	tokens: typing.List[tokenize_.TokenInfo],
-	start_index: int = 0,
+	if start_row == line:
+		start_col += offset
+	if end_row == line:
+		end_col += offset
+	return tok._replace(start=(start_row, start_col), end=(end_row, end_col))
+
+def import_call_tokens(
+	identifier: str,
+	start: typing.Tuple[int, int],
+	line: str,
 	*,
-	line: int,
-	offset: int,
-) -> None:
-	"""Takes a list of tokens and changes the offset of some of the tokens in place."""
+	imports='importlib',
+	position=None,
+) -> typing.List[tokenize_.TokenInfo]:
+	"""Return the tokens of a call that imports the given module, laid out on one line from the given position.
 
-	for i, tok in enumerate(tokens[start_index:], start=start_index):
-		if tok.start[0] != line:
-			break
-		tokens[i] = offset_token_horizontal(tok, offset)
+	The AST transformer generates the same call.
+	For imports="instrumented", position is the "line:column" of the import expression passed to the helper.
+	"""
+
+	if imports in IMPORT_HELPERS:
+		func = [(tokenize_.NAME, IMPORT_HELPERS[imports])]
+	else:
+		func = [
+			(tokenize_.NAME, "__import__"),
+			(tokenize_.OP, "("),
+			(tokenize_.STRING, '"importlib"'),
+			(tokenize_.OP, ")"),
+			(tokenize_.OP, "."),
+			(tokenize_.NAME, "import_module"),
+		]
+
+	row, col = start
+	tokens = []
+	for tok_type, string in func + [
+		(tokenize_.OP, "("),
+		(tokenize_.STRING, repr(identifier)),
+		*([(tokenize_.OP, ","), (tokenize_.STRING, repr(position))] if imports == 'instrumented' else []),
+		(tokenize_.OP, ")"),
+	]:
+		tokens.append(tokenize_.TokenInfo(tok_type, string, (row, col), (row, col + len(string)), line))
+		col += len(string)
+	return tokens
+
+def _is_import_op(tok: tokenize_.TokenInfo) -> bool:
+	# "!" is only an OP in >=3.12.
+	return tok.type in {tokenize_.OP, tokenize_.ERRORTOKEN} and tok.string == IMPORT_OP
+
+def _find_import_expr(
+	tokens: typing.Sequence[tokenize_.TokenInfo],
+	end: int,
+	op_tok: tokenize_.TokenInfo,
+	next_tok: typing.Optional[tokenize_.TokenInfo],
+	*,
+	check_names: bool,
+) -> typing.Optional[int]:
+	"""Return the index in tokens of the start of the inline import expression whose "!" op_tok would come
+	at index end, followed by next_tok, or None if that "!" is not part of a valid inline import expression.
 
-def transform_tokens(tokens: typing.Iterable[tokenize_.TokenInfo]) -> typing.List[tokenize_.TokenInfo]:
+	If check_names is True, names that can't be module names, e.g. ".a!" or "not!", are rejected as well.
+	"""
+	# The "!" must directly follow the name, e.g. "d !" is not an inline import expression.
+	# Before Python 3.12 the tokenizer also returns the space as a token of its own, but since then it's skipped.
+	if end == 0 or tokens[end - 1].end != op_tok.start:
+		return None
+
+	# Collect all name and attribute access-related tokens directly connected to the "!".
+	start = end
+	looking_for_name = True
+	while start > 0 and tokens[start - 1].exact_type == (tokenize_.NAME if looking_for_name else tokenize_.DOT):
+		start -= 1
+		looking_for_name = not looking_for_name
+
+	# The "!" was placed somewhere in a class definition, e.g. "class Fo!o: pass".
+	has_invalid_syntax = start > 0 and tokens[start - 1].string == "class" and tokens[start - 1].type == tokenize_.NAME
+
+	# There's a name immediately following "!". Might be a f-string conversion flag
+	# like "f'{thing!r}'" or just something invalid like "def fo!o(): pass".
+	has_invalid_syntax = has_invalid_syntax or (next_tok is not None and next_tok.type == tokenize_.NAME)
+
+	if check_names and not has_invalid_syntax and start != end:
+		# With no AST transformer to reject them later, names that can't be module names have to be caught here.
+		has_invalid_syntax = (
+			tokens[start].type != tokenize_.NAME
+			or any(keyword.iskeyword(old_tok.string) for old_tok in tokens[start:end])
+		)
+
+	if has_invalid_syntax or start == end:
+		return None
+	return start
+
+def transform_tokens(
+	tokens: typing.Iterable[tokenize_.TokenInfo],
+	*,
+	direct=False,
+	imports='importlib',
+) -> typing.List[tokenize_.TokenInfo]:
 	"""Find the inline import expressions in a list of tokens and replace the relevant tokens to wrap the imported
 	modules with a call to MARKER.
 
 	Later, the AST transformer step will replace those with valid import expressions.
+	If direct is True, the tokens are instead replaced with the valid import expressions right away,
+	generated according to the imports argument (see import_call_tokens).
 	"""
+	return list(iter_transform_tokens(tokens, direct=direct, imports=imports))
 
-	orig_tokens = list(tokens)
-	new_tokens: typing.List[tokenize_.TokenInfo] = []
+# how many transformed tokens iter_transform_tokens holds on to before passing them on
+_TOKEN_BUFFER_SIZE = 64
 
-	for orig_i, tok in enumerate(orig_tokens):
-		# "!" is only an OP in >=3.12.
-		if tok.type in {tokenize_.OP, tokenize_.ERRORTOKEN} and tok.string == IMPORT_OP:
-			has_invalid_syntax = False
+def iter_transform_tokens(
+	tokens: typing.Iterable[tokenize_.TokenInfo],
+	*,
+	direct=False,
+	imports='importlib',
+) -> typing.Iterator[tokenize_.TokenInfo]:
+	"""Like transform_tokens, but yield the transformed tokens as it goes, only holding on to a few at a time."""
+	tokens = iter(tokens)
+	new_tokens: typing.List[tokenize_.TokenInfo] = []
 
-			# Collect all name and attribute access-related tokens directly connected to the "!".
-			last_place = len(new_tokens)
-			looking_for_name = True
+	# Every inline import expression shifts the rest of its line to the right by the width of the code that replaces it.
+	# Rather than fixing up the rest of the line each time, keep a running offset for the current line
+	# and apply it to each token as it's copied over.
+	offset_line = offset = 0
+	marker_width = len(MARKER) + 1
 
-			for old_tok in reversed(new_tokens):
-				if old_tok.exact_type != (tokenize_.NAME if looking_for_name else tokenize_.DOT):
-					# The "!" was placed somewhere in a class definition, e.g. "class Fo!o: pass".
-					has_invalid_syntax = (old_tok.exact_type == tokenize_.NAME and old_tok.string == "class")
+	next_tok = next(tokens, None)
+	while next_tok is not None:
+		tok, next_tok = next_tok, next(tokens, None)
 
-					# There's a name immediately following "!". Might be a f-string conversion flag
-					# like "f'{thing!r}'" or just something invalid like "def fo!o(): pass".
-					try:
-						peek = orig_tokens[orig_i + 1]
-					except IndexError:
-						pass
-					else:
-						has_invalid_syntax = (has_invalid_syntax or peek.type == tokenize_.NAME)
+		# Only the run of names and dots at the end of new_tokens can become part of an import expression,
+		# and only the token before them is looked at, so everything before that can be passed on.
+		if len(new_tokens) >= _TOKEN_BUFFER_SIZE and new_tokens[-1].exact_type not in {tokenize_.NAME, tokenize_.DOT}:
+			# keep a few more for the hack at the end
+			yield from new_tokens[:-4]
+			del new_tokens[:-4]
 
-					break
+		if offset:
+			tok = offset_token_horizontal(tok, offset, line=offset_line)
 
-				last_place -= 1
-				looking_for_name = not looking_for_name
+		if _is_import_op(tok):
+			last_place = _find_import_expr(new_tokens, len(new_tokens), tok, next_tok, check_names=direct)
 
 			# The "!" is just by itself or in a bad spot. Let it error later if it's wrong.
 			# Also allows other token transformers to work with it without erroring early.
-			if has_invalid_syntax or last_place == len(new_tokens):
+			if last_place is None:
 				new_tokens.append(tok)
 				continue
 
-			# Insert a call to the MARKER just before the inline import expression.
 			old_first = new_tokens[last_place]
 			old_f_row, old_f_col = old_first.start
 
-			new_tokens[last_place:last_place] = [
-				old_first._replace(type=tokenize_.NAME, string=MARKER, end=(old_f_row, old_f_col + len(MARKER))),
-				tokenize_.TokenInfo(
-					tokenize_.OP,
-					"(",
-					(old_f_row, old_f_col + len(MARKER)),
-					(old_f_row, old_f_col + len(MARKER)+1),
+			if direct:
+				identifier = "".join(old_tok.string for old_tok in new_tokens[last_place:])
+				# tokens on this line have already been shifted by the import expressions before them
+				orig_f_col = old_f_col - offset if old_f_row == offset_line else old_f_col
+				new_tokens[last_place:] = import_call_tokens(
+					identifier,
+					old_first.start,
 					old_first.line,
-				),
-			]
-
-			# Adjust the positions of the following tokens within the inline import expression.
-			new_tokens[last_place + 2:] = (offset_token_horizontal(tok, len(MARKER)+1) for tok in new_tokens[last_place + 2:])
-
-			# Add a closing parenthesis.
-			(end_row, end_col) = new_tokens[-1].end
-			line = new_tokens[-1].line
-			end_paren_token = tokenize_.TokenInfo(tokenize_.OP, ")", (end_row, end_col), (end_row, end_col + 1), line)
-			new_tokens.append(end_paren_token)
-
-			# Fix the positions of the rest of the tokens on the same line.
-			fixed_line_tokens: typing.List[tokenize_.TokenInfo] = []
-			offset_line_horizontal(orig_tokens, orig_i, line=new_tokens[-1].start[0], offset=len(MARKER)+1)
-
-			# Check the rest of the line for inline import expressions.
-			new_tokens.extend(transform_tokens(fixed_line_tokens))
+					imports=imports,
+					position=f'{old_f_row}:{orig_f_col + 1}',
+				)
+				# The replacement is not necessarily wider than what it replaces, e.g. "a . b!".
+				shift = new_tokens[-1].end[1] - tok.end[1]
+			else:
+				# Adjust the positions of the tokens within the inline import expression.
+				new_tokens[last_place:] = [
+					offset_token_horizontal(old_tok, marker_width, line=old_f_row)
+					for old_tok in new_tokens[last_place:]
+				]
+
+				# Insert a call to the MARKER just before the inline import expression.
+				new_tokens[last_place:last_place] = [
+					old_first._replace(type=tokenize_.NAME, string=MARKER, end=(old_f_row, old_f_col + len(MARKER))),
+					tokenize_.TokenInfo(
+						tokenize_.OP,
+						"(",
+						(old_f_row, old_f_col + len(MARKER)),
+						(old_f_row, old_f_col + len(MARKER)+1),
+						old_first.line,
+					),
+				]
+
+				# Add a closing parenthesis.
+				(end_row, end_col) = new_tokens[-1].end
+				line = new_tokens[-1].line
+				end_paren_token = tokenize_.TokenInfo(tokenize_.OP, ")", (end_row, end_col), (end_row, end_col + 1), line)
+				new_tokens.append(end_paren_token)
+				shift = marker_width
+
+			# Shift the rest of the line. If the inline import expression started on a previous line
+			# (by way of a backslash continuation), the rest of this line doesn't need to move.
+			if old_f_row == tok.start[0]:
+				if offset_line != old_f_row:
+					offset_line, offset = old_f_row, 0
+				offset += shift
 
 		else:
 			new_tokens.append(tok)
@@ -164,12 +428,97 @@ def transform_tokens(tokens: typing.Iterable[tokenize_.TokenInfo]) -> typing.Lis
 		):
 			del new_tokens[-2]
 
-	return new_tokens
+	yield from new_tokens
+
+def find_imports(s: typing.AnyStr, filename=DEFAULT_FILENAME) -> typing.List[typing.Tuple[str, int, int]]:
+	"""Return the module, line, and column of each inline import expression in the given source code.
+
+	See find_import_tokens.
+	"""
+	if (IMPORT_OP not in s) if isinstance(s, str) else (_IMPORT_OP_BYTES_RE.search(s) is None):
+		return []
+	tokens, _ = tokenize(s)
+	return find_import_tokens(_iter_tokens(tokens, s, filename))
+
+def find_import_tokens(tokens: typing.Iterable[tokenize_.TokenInfo]) -> typing.List[typing.Tuple[str, int, int]]:
+	"""Return the module, line, and column (both starting from 1) of each inline import expression in the given tokens,
+	in the order they appear, without transforming them.
+
+	Unlike parsing the result of fix_syntax, this does not check that the rest of the source code is valid.
+	"""
+	tokens = iter(tokens)
+	imports = []
+	# like in iter_transform_tokens, only the last few tokens need to be kept
+	seen = []
+	next_tok = next(tokens, None)
+	while next_tok is not None:
+		tok, next_tok = next_tok, next(tokens, None)
+		if len(seen) >= _TOKEN_BUFFER_SIZE and seen[-1].exact_type not in {tokenize_.NAME, tokenize_.DOT}:
+			del seen[:-1]
+
+		if _is_import_op(tok):
+			start = _find_import_expr(seen, len(seen), tok, next_tok, check_names=True)
+			if start is not None:
+				row, col = seen[start].start
+				imports.append(("".join(name_tok.string for name_tok in seen[start:]), row, col + 1))
+		seen.append(tok)
+	return imports
 
 def tokenize(source) -> (str, str):
+	"""Return an iterator of the tokens of the given str or bytes-like source code, and its encoding.
+
+	Tokens of a str have no ENCODING token, so they untokenize to a str.
+	"""
 	if isinstance(source, str):
-		source = source.encode('utf-8')
-	stream = io.BytesIO(source)
-	encoding, _ = tokenize_.detect_encoding(stream.readline)
-	stream.seek(0)
-	return tokenize_.tokenize(stream.readline), encoding
+		return tokenize_.generate_tokens(readline(source)), 'utf-8'
+	encoding, _ = tokenize_.detect_encoding(readline(source))
+	return tokenize_.tokenize(readline(source)), encoding
+
+_LINE_RE = re.compile(r'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+')
+_BYTES_LINE_RE = re.compile(_LINE_RE.pattern.encode())
+
+def readline(source: typing.Union[str, typing.ByteString]) -> typing.Callable[[], typing.AnyStr]:
+	"""Return a function that returns the next line of the given str or bytes-like source code each time it's called,
+	like the readline method of a file, without copying all of the source code up front like io.StringIO does.
+
+	Like compile, lines may end in \\n, \\r\\n, or \\r. The tokenize module doesn't recognize the last of these,
+	so they are returned ending in \\n instead.
+	"""
+	if isinstance(source, str):
+		return functools.partial(next, _iter_lines(source, _LINE_RE, '\r', '\n'), '')
+	return functools.partial(next, _iter_lines(source, _BYTES_LINE_RE, b'\r', b'\n'), b'')
+
+def _iter_lines(source, line_re, cr, lf):
+	for match in line_re.finditer(source):
+		# matches of a memoryview are memoryviews, but tokenize needs bytes
+		line = match.group() if isinstance(source, str) else bytes(match.group())
+		if line[-1:] == cr:
+			line = line[:-1] + lf
+		yield line
+
+_NEWLINE_RE = re.compile(r'\r\n|\r|\n')
+_BYTES_NEWLINE_RE = re.compile(_NEWLINE_RE.pattern.encode())
+
+def get_line(source: typing.Union[str, typing.ByteString], lineno: int) -> typing.Optional[typing.AnyStr]:
+	"""Return the given line (starting from 1) of the source code without its line ending, or None if there is none.
+
+	Only the lines up to the one returned are scanned, and none of them are copied.
+	"""
+	if lineno < 1:
+		return None
+
+	newline_re = _NEWLINE_RE if isinstance(source, str) else _BYTES_NEWLINE_RE
+	start = 0
+	current = 1
+	for match in newline_re.finditer(source):
+		if current == lineno:
+			line = source[start:match.start()]
+			break
+		current += 1
+		start = match.end()
+	else:
+		if current != lineno or start >= len(source):
+			return None
+		line = source[start:]
+
+	return line if isinstance(line, (str, bytes)) else bytes(line)
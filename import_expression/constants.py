@@ -22,3 +22,21 @@ IMPORT_OP = '!'
 MARKER = '_IMPORT_MARKER'
 
 DEFAULT_FILENAME = '<string>'
+
+# the default number of code objects kept by the compile cache
+DEFAULT_CACHE_SIZE = 1024
+
+# how long in seconds the REPL's tab completion waits for a module to be imported before giving up until the next Tab
+DEFAULT_COMPLETION_TIMEOUT = 0.2
+
+# how many lines import-expression -e reads and processes at a time
+DEFAULT_STREAM_BATCH_SIZE = 1024
+# how many characters import-expression -e reads at a time when lines are separated by something other than newlines
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# code compiled with imports= set to one of these keys calls the corresponding builtin to import modules
+IMPORT_HELPERS = {
+	'cached': '__import_expression_import__',
+	'lazy': '__import_expression_lazy_import__',
+	'instrumented': '__import_expression_instrumented_import__',
+}
@@ -18,14 +18,27 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import ast
+import builtins
 import contextlib
+import functools
+import importlib.machinery
+import importlib.util
 import os
+import sys
 import textwrap
+from py_compile import PycInvalidationMode
 
 import pytest
 
 import import_expression as ie
 
+@pytest.fixture(params=['ast', 'tokens'])
+def engine(request, monkeypatch):
+	"""run the test with each compile engine"""
+	monkeypatch.setattr(ie, 'compile', functools.partial(ie.compile, engine=request.param))
+	return request.param
+
 invalid_attribute_cases = (
 	# arrange this as if ! is binary 1, empty str is 0
 	'!a',
@@ -50,15 +63,18 @@ invalid_attribute_cases = (
 	'ab.b!c',
 )
 
+@pytest.mark.usefixtures('engine')
 @pytest.mark.parametrize('valid', [f'"{invalid}"' for invalid in invalid_attribute_cases])
 def test_valid_string_literals(valid):
 	ie.compile(valid)
 
+@pytest.mark.usefixtures('engine')
 @pytest.mark.parametrize('invalid', invalid_attribute_cases)
 def test_invalid_attribute_syntax(invalid):
 	with pytest.raises(SyntaxError):
 		ie.compile(invalid)
 
+@pytest.mark.usefixtures('engine')
 def test_import_op_as_attr_name():
 	with pytest.raises(SyntaxError):
 		ie.compile('a.!.b')
@@ -71,6 +87,7 @@ for test in (
 	del_store_import_tests.append(f'del {test}')
 	del_store_import_tests.append(f'{test} = 1')
 
+@pytest.mark.usefixtures('engine')
 @pytest.mark.parametrize('test', del_store_import_tests)
 def test_del_store_import(test):
 	ie.compile(test)
@@ -83,6 +100,7 @@ for test in (
 	invalid_del_store_import_tests.append(f'del {test}')
 	invalid_del_store_import_tests.append(f'{test} = 1')
 
+@pytest.mark.usefixtures('engine')
 @pytest.mark.parametrize('test', invalid_del_store_import_tests)
 def test_invalid_del_store_import(test):
 	with pytest.raises((
@@ -91,10 +109,12 @@ def test_invalid_del_store_import(test):
 	)):
 		ie.compile(test)
 
+@pytest.mark.usefixtures('engine')
 def test_lone_import_op():
 	with pytest.raises(SyntaxError):
 		ie.compile('!')
 
+@pytest.mark.usefixtures('engine')
 @pytest.mark.parametrize('invalid', (
 	'def foo(x!): pass',
 	'def foo(*x!): pass',
@@ -108,6 +128,7 @@ def test_invalid_argument_syntax(invalid):
 	with pytest.raises(SyntaxError):
 		ie.compile(invalid)
 
+@pytest.mark.usefixtures('engine')
 @pytest.mark.parametrize('invalid', (
 	'def !foo(y): pass',
 	'def fo!o(y): pass',
@@ -123,6 +144,7 @@ def test_invalid_def_syntax(invalid):
 	with pytest.raises(SyntaxError):
 		ie.compile(invalid)
 
+@pytest.mark.usefixtures('engine')
 def test_del_store_attribute():
 	class AttributeBox:
 		pass
@@ -136,6 +158,7 @@ def test_del_store_attribute():
 	ie.exec('del x.y', g)
 	assert not hasattr(x, 'y')
 
+@pytest.mark.usefixtures('engine')
 def test_kwargs():
 	# see issue #1
 	ie.compile('f(**a)', mode='eval')
@@ -143,6 +166,7 @@ def test_kwargs():
 	import collections
 	assert ie.eval('dict(x=collections!)')['x'] is collections
 
+@pytest.mark.usefixtures('engine')
 @pytest.mark.parametrize(('stmt', 'annotation_var'), (
 	('def foo() -> typing!.Any: pass', 'return'),
 	('def foo(x: typing!.Any): pass', 'x'),
@@ -154,9 +178,11 @@ def test_typehint_conversion(stmt, annotation_var):
 	ie.exec(stmt, g)
 	assert g['foo'].__annotations__[annotation_var] is Any
 
+@pytest.mark.usefixtures('engine')
 def test_comments():
 	ie.exec('# a')
 
+@pytest.mark.usefixtures('engine')
 @pytest.mark.parametrize('invalid', (
 	'import x!',
 	'import x.y!',
@@ -170,6 +196,7 @@ def test_import_statement(invalid):
 	with pytest.raises(SyntaxError):
 		ie.compile(invalid, mode='exec')
 
+@pytest.mark.usefixtures('engine')
 def test_eval_exec():
 	import ipaddress
 	import urllib.parse
@@ -208,15 +235,18 @@ def test_eval_exec():
 
 	assert g['foo'](1) == 'can we make it into jishaku?'
 
+@pytest.mark.usefixtures('engine')
 def test_flags():
 	import ast
 	assert isinstance(ie.compile('foo', flags=ast.PyCF_ONLY_AST), ast.AST)
 
+@pytest.mark.usefixtures('engine')
 def test_eval_code_object():
 	import collections
 	code = ie.compile('collections!.Counter', '', 'eval')
 	assert ie.eval(code) is collections.Counter
 
+@pytest.mark.usefixtures('engine')
 def test_exec_code_object():
 	import collections
 	code = ie.compile('def foo(): return collections!.Counter', '', 'exec')
@@ -224,30 +254,843 @@ def test_exec_code_object():
 	ie.exec(code, globals=g)
 	assert g['foo']() is collections.Counter
 
+@pytest.mark.usefixtures('engine')
 @pytest.mark.parametrize('invalid', (')', '"'))
 def test_normal_invalid_syntax(invalid):
 	"""ensure regular syntax errors are still caught"""
 	with pytest.raises(SyntaxError):
 		ie.compile(invalid)
 
+@pytest.mark.usefixtures('engine')
 def test_dont_imply_dedent():
 	from codeop import PyCF_DONT_IMPLY_DEDENT
 	with pytest.raises(SyntaxError):
 		ie.compile('def foo():\n\tpass', mode='single', flags=PyCF_DONT_IMPLY_DEDENT)
 
+def test_dont_imply_dedent_parse():
+	from codeop import PyCF_DONT_IMPLY_DEDENT, PyCF_ALLOW_INCOMPLETE_INPUT
+	flags = PyCF_DONT_IMPLY_DEDENT | PyCF_ALLOW_INCOMPLETE_INPUT
+	with pytest.raises(SyntaxError, match='incomplete input'):
+		ie.parse('if x:\n\tos!.sep', mode='single', flags=flags)
+	assert isinstance(ie.parse('os!.sep\n', mode='single', flags=flags), ast.Interactive)
+
+@pytest.mark.usefixtures('engine')
 def test_transform_ast():
 	from typing import Any
 	node = ie.parse(ie.parse('typing!.Any', mode='eval'))
 	assert ie.eval(node) is Any
 
+@pytest.mark.usefixtures('engine')
 def test_locals_arg():
 	ie.exec('assert locals() is globals()', {})
 	ie.exec('assert locals() is not globals()', {}, {})
 
+@pytest.mark.usefixtures('engine')
 def test_bytes():
 	import typing
 	assert ie.eval(b'typing!.TYPE_CHECKING') == typing.TYPE_CHECKING
 
+@pytest.mark.usefixtures('engine')
+def test_bytes_like(tmp_path):
+	import mmap
+	source = '# coding: latin-1\nx = "é", os.path!.join("a", "b")\ny = collections!.Counter\n'.encode('latin-1')
+	path = tmp_path / 'source.py'
+	path.write_bytes(source)
+	with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+		for source in (source, bytearray(source), memoryview(source), mapped):
+			g = {}
+			ie.exec(ie.compile(source), g)
+			assert g['x'] == ('é', os.path.join('a', 'b'))
+			assert g['y'].__name__ == 'Counter'
+
+	with pytest.raises(SyntaxError) as excinfo:
+		ie.compile(memoryview(b'x = os!.sep\ny = (\n'))
+	assert (excinfo.value.lineno, excinfo.value.text) == (2, b'y = (')
+	with pytest.raises(SyntaxError) as excinfo:
+		ie.compile(memoryview(b"x = os!.sep\ny = '''a\nb"))
+	assert (excinfo.value.lineno, excinfo.value.text) == (2, b"y = '''a")
+	with pytest.raises(TypeError):
+		ie.compile(1)
+
+@pytest.mark.usefixtures('engine')
 def test_beat_is_gay():
 	with pytest.raises(SyntaxError):
 		ie.compile('"beat".succ!')
+
+@contextlib.contextmanager
+def fresh_cache(**kwargs):
+	ie.cache_clear()
+	ie.cache_configure(**kwargs)
+	try:
+		yield
+	finally:
+		ie.cache_configure()
+		ie.cache_clear()
+
+def test_compile_cache():
+	with fresh_cache():
+		code = ie.compile('collections!.Counter', mode='eval')
+		assert ie.compile('collections!.Counter', mode='eval') is code
+		assert ie.compile('collections!.Counter', mode='exec') is not code
+		info = ie.cache_info()
+		assert (info.hits, info.misses, info.currsize) == (1, 2, 2)
+
+		ie.cache_clear()
+		assert ie.cache_info().currsize == 0
+
+def test_compile_cache_filename():
+	with fresh_cache():
+		source = 'def foo(): return collections!.Counter'
+		a = ie.compile(source, 'a.py')
+		b = ie.compile(source, 'b.py')
+		assert a.co_filename == 'a.py'
+		assert b.co_filename == 'b.py'
+		assert all(const.co_filename == 'b.py' for const in b.co_consts if isinstance(const, type(b)))
+		assert ie.cache_info().currsize == 1
+
+def test_compile_cache_eviction():
+	with fresh_cache(maxsize=2):
+		for source in ('a!', 'b!', 'c!'):
+			ie.compile(source)
+		info = ie.cache_info()
+		assert (info.currsize, info.evictions) == (2, 1)
+
+		# a! was evicted, so this is a miss
+		ie.compile('a!')
+		assert ie.cache_info().hits == 0
+		ie.compile('c!')
+		assert ie.cache_info().hits == 1
+
+	with fresh_cache(maxsize=None, maxbytes=1):
+		ie.compile('a!')
+		assert ie.cache_info().currsize == 0
+
+	with fresh_cache(maxsize=0):
+		ie.compile('a!')
+		assert ie.cache_info().currsize == 0
+
+	with fresh_cache(maxsize=2):
+		ie.compile('a!')
+		for limits in (dict(maxsize=-1), dict(maxsize=None, maxbytes=-1)):
+			with pytest.raises(ValueError):
+				ie.cache_configure(**limits)
+		info = ie.cache_info()
+		assert (info.maxsize, info.currsize) == (2, 1)
+
+@pytest.mark.parametrize('maxsize', [8, 1024, None])
+def test_compile_cache_threads(maxsize):
+	import concurrent.futures
+
+	def work(n):
+		results = []
+		for i in range(100):
+			j = (n + i) % 32
+			results.append((j, ie.compile(f'x = (os!.sep, {j})', f'{n}.py'), n))
+			assert ie.find_imports(f'x = (os!.sep, {j})') == ['os']
+			if i % 25 == 0:
+				ie.cache_info()
+		return results
+
+	old_interval = sys.getswitchinterval()
+	# switch threads as often as possible, to make races likely
+	sys.setswitchinterval(1e-6)
+	try:
+		with fresh_cache(maxsize=maxsize), concurrent.futures.ThreadPoolExecutor(8) as pool:
+			results = [result for results in pool.map(work, range(8)) for result in results]
+			info = ie.cache_info()
+	finally:
+		sys.setswitchinterval(old_interval)
+
+	assert info.hits + info.misses == len(results)
+	assert info.currsize <= (maxsize or 32)
+	for j, code, n in results:
+		assert code.co_filename == f'{n}.py'
+		g = {}
+		ie.exec(code, g)
+		assert g['x'] == (os.sep, j)
+
+def test_compile_cache_errors_not_cached():
+	with fresh_cache():
+		for _ in range(2):
+			with pytest.raises(SyntaxError):
+				ie.compile('a.!b')
+		assert ie.cache_info().currsize == 0
+
+@pytest.fixture
+def write_bytecode(monkeypatch):
+	monkeypatch.setattr('sys.dont_write_bytecode', False)
+
+@pytest.mark.parametrize('invalidation_mode', list(PycInvalidationMode))
+def test_bytecode_cache(tmp_path, monkeypatch, write_bytecode, invalidation_mode):
+	from import_expression import _bytecode
+
+	path = tmp_path / 'script.py'
+	path.write_text('x = collections!.Counter("aab")')
+	cache_path = _bytecode.cache_from_source(str(path))
+
+	g = {}
+	ie.exec(_bytecode.get_code(str(path), invalidation_mode=invalidation_mode), g)
+	assert g['x'] == dict(a=2, b=1)
+	assert os.path.exists(cache_path)
+
+	def fail(*args, **kwargs):
+		raise AssertionError('the bytecode cache was not used')
+
+	with monkeypatch.context() as m:
+		m.setattr(_bytecode, 'compile', fail)
+		code = _bytecode.get_code(str(path), invalidation_mode=invalidation_mode)
+		assert code.co_filename == str(path)
+
+		path.write_text('x = collections!.Counter("abbb")')
+		os.utime(path, (0, 0))
+		if invalidation_mode == PycInvalidationMode.UNCHECKED_HASH:
+			_bytecode.get_code(str(path), invalidation_mode=invalidation_mode)
+		else:
+			with pytest.raises(AssertionError):
+				_bytecode.get_code(str(path), invalidation_mode=invalidation_mode)
+
+		# the cache also gets replaced when a different invalidation mode is requested
+		other_mode = next(mode for mode in PycInvalidationMode if mode != invalidation_mode)
+		with pytest.raises(AssertionError):
+			_bytecode.get_code(str(path), invalidation_mode=other_mode)
+
+	g = {}
+	ie.exec(_bytecode.get_code(str(path), invalidation_mode=invalidation_mode), g)
+	if invalidation_mode == PycInvalidationMode.UNCHECKED_HASH:
+		# by design, the stale cache is still used
+		assert g['x'] == dict(a=2, b=1)
+	else:
+		assert g['x'] == dict(a=1, b=3)
+
+@pytest.mark.parametrize('invalidation_mode', [PycInvalidationMode.CHECKED_HASH, PycInvalidationMode.UNCHECKED_HASH])
+def test_bytecode_cache_any_mode(tmp_path, monkeypatch, write_bytecode, invalidation_mode):
+	from import_expression import _bytecode
+
+	path = tmp_path / 'script.py'
+	path.write_text('x = collections!.Counter("aab")')
+	cache_path = _bytecode.cache_from_source(str(path))
+	assert ie.compile_many([path], invalidation_mode=invalidation_mode)[0].compiled
+	with open(cache_path, 'rb') as f:
+		data = f.read()
+
+	# without a mode being asked for, the precompiled cache is used as is
+	with monkeypatch.context() as m:
+		m.setattr(_bytecode, 'compile', None)
+		g = {}
+		ie.exec(_bytecode.get_code(str(path)), g)
+	assert g['x'] == dict(a=2, b=1)
+	with open(cache_path, 'rb') as f:
+		assert f.read() == data
+
+def test_bytecode_cache_filename(tmp_path, monkeypatch, write_bytecode):
+	import traceback
+	from import_expression import _bytecode
+
+	(tmp_path / 'sub').mkdir()
+	(tmp_path / 'sub' / 'script.py').write_text('def f():\n\treturn 1 / 0\n')
+
+	for cwd, path in ((tmp_path / 'sub', 'script.py'), (tmp_path, os.path.join('sub', 'script.py'))):
+		monkeypatch.chdir(cwd)
+		g = {}
+		ie.exec(_bytecode.get_code(path), g)
+		with pytest.raises(ZeroDivisionError) as excinfo:
+			g['f']()
+		frame = traceback.extract_tb(excinfo.value.__traceback__)[-1]
+		assert frame.filename == path
+		assert frame.line == 'return 1 / 0'
+
+def test_bytecode_cache_disabled(tmp_path, write_bytecode):
+	from import_expression import _bytecode
+
+	path = tmp_path / 'script.py'
+	path.write_text('x = 1')
+	_bytecode.get_code(str(path), use_cache=False)
+	assert not os.path.exists(_bytecode.cache_from_source(str(path)))
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_compile_many(tmp_path, monkeypatch, workers):
+	from import_expression import _bytecode
+
+	pkg = tmp_path / 'pkg'
+	(pkg / 'sub').mkdir(parents=True)
+	(pkg / '__init__.py').write_text('x = collections!.Counter')
+	(pkg / 'sub' / 'mod.py').write_text('y = 1')
+	(pkg / 'broken.py').write_text('y = (')
+	(pkg / 'data.txt').write_text('not python')
+
+	results = ie.compile_many([pkg], workers=workers)
+	paths = [str(pkg / '__init__.py'), str(pkg / 'broken.py'), str(pkg / 'sub' / 'mod.py')]
+	assert [result.path for result in results] == paths
+	assert [result.compiled for result in results] == [True, False, True]
+	assert isinstance(results[1].error, SyntaxError)
+	assert results[0].error is results[2].error is None
+
+	g = {}
+	with monkeypatch.context() as m:
+		m.setattr(_bytecode, 'compile', None)
+		ie.exec(_bytecode.get_code(paths[0]), g)
+	assert g['x'].__name__ == 'Counter'
+
+	# up to date caches are skipped
+	results = ie.compile_many([pkg / 'sub' / 'mod.py', pkg / 'missing.py'], workers=workers)
+	assert results[0] == (paths[2], False, None)
+	assert isinstance(results[1].error, FileNotFoundError)
+	assert ie.compile_many([pkg / 'sub'], workers=workers, force=True)[0].compiled
+
+@pytest.mark.usefixtures('engine')
+@pytest.mark.parametrize('newline', ['\n', '\r\n', '\r'])
+def test_transform_skipped_statements(newline):
+	# only statements on lines with import expressions are transformed, which must account for decorators and newlines
+	source = newline.join([
+		'def f(): pass',
+		'@functools!.wraps(f)',
+		'def g(): pass',
+		'x = (1,',
+		'\t2, os!.sep)',
+		'y = [',
+		'\tcollections!.Counter]',
+	])
+	g = {}
+	ie.exec(ie.compile(source), g)
+	assert g['g'].__name__ == 'f'
+	assert g['x'] == (1, 2, os.sep)
+	assert g['y'][0].__name__ == 'Counter'
+	for source in (source, source.encode()):
+		for engine in ('ast', 'tokens'):
+			assert ie.find_imports(source, positions=True, engine=engine) == [
+				('functools', 2, 2), ('os', 5, 5), ('collections', 7, 2),
+			]
+
+def test_find_imports_positions():
+	source = 'x = (a!.b, é!.c)\ny = [d.e!.f,\n\tg!]'
+	assert ie.find_imports(source) == ['a', 'é', 'd.e', 'g']
+	assert ie.find_imports(source, positions=True) == [('a', 1, 6), ('é', 1, 12), ('d.e', 2, 6), ('g', 3, 2)]
+
+def test_find_imports_positions_encoding(monkeypatch):
+	source = '# -*- coding: latin-1 -*-\nx = ("éèà", os!.sep)\n'
+	expected = [('os', 2, 13)]
+	assert ie.find_imports(source, positions=True) == expected
+	for engine in ('ast', 'tokens'):
+		assert ie.find_imports(source.encode('latin-1'), positions=True, engine=engine) == expected
+
+	monkeypatch.setattr(ie._runtime, '_stats', {})
+	ie.exec(ie.compile(source.encode('latin-1'), 'latin.py', imports='instrumented'))
+	assert list(ie.import_stats()) == ['latin.py:2:13']
+
+@pytest.mark.parametrize('source', (
+	'x = (a!.b, é!.c)\ny = [d.e!.f,\n\tg!]',
+	'x = a . b!.c\nif x != 1:\n\tprint(f"{x!r}", "y!.z") # z!.y',
+	'x = 1',
+	'',
+))
+@pytest.mark.parametrize('type', [str, bytes, bytearray, memoryview])
+def test_find_imports_engines(engine, source, type):
+	expected = ie.find_imports(source, positions=True)
+	if type is not str:
+		source = type(source.encode())
+	assert ie.find_imports(source, positions=True, engine=engine) == expected
+	assert ie.find_imports(source, positions=True, engine='tokens') == expected
+
+def test_find_imports_tokens_engine():
+	# the tokens engine doesn't parse the source, so it doesn't notice invalid syntax outside of import expressions
+	assert ie.find_imports('x = = os!.sep', engine='tokens') == ['os']
+	assert ie.find_imports('not!.x + .a! + a!.b!', engine='tokens') == ['a']
+	with pytest.raises(SyntaxError):
+		ie.find_imports('x = (os!.sep', engine='tokens')
+	with pytest.raises(ValueError):
+		ie.find_imports('x', engine='bogus')
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_find_imports_in_paths(tmp_path, monkeypatch, workers):
+	from import_expression import _scan
+
+	(tmp_path / 'sub').mkdir()
+	(tmp_path / 'a.py').write_text('x = os!.sep\ny = (1, os.path!.join)')
+	(tmp_path / 'sub' / 'b.py').write_text('z = collections!.Counter')
+	(tmp_path / 'broken.py').write_text('y = (')
+	cache = tmp_path / 'cache.json'
+
+	results = list(ie.find_imports_in_paths([tmp_path], workers=workers, cache=cache))
+	assert [result.path for result in results] == [str(tmp_path / name) for name in ('a.py', 'broken.py', 'sub/b.py')]
+	assert results[0].imports == [('os', 1, 5), ('os.path', 2, 9)]
+	assert results[2] == (str(tmp_path / 'sub' / 'b.py'), [('collections', 1, 5)], None)
+	assert isinstance(results[1].error, SyntaxError)
+	assert list(_scan.index(results)) == ['collections', 'os', 'os.path']
+
+	# only files that changed are scanned again
+	(tmp_path / 'sub' / 'b.py').write_text('z = itertools!.chain')
+	os.utime(tmp_path / 'a.py', ns=(0, 0))
+	scanned = []
+	scan_file = _scan.scan_file
+	monkeypatch.setattr(_scan, 'scan_file', lambda path: scanned.append(path) or scan_file(path))
+	results = list(ie.find_imports_in_paths([tmp_path], workers=1, cache=cache))
+	assert scanned == [str(tmp_path / 'broken.py'), str(tmp_path / 'sub' / 'b.py')]
+	assert results[0].imports == [('os', 1, 5), ('os.path', 2, 9)]
+	assert results[2].imports == [('itertools', 1, 5)]
+
+@pytest.fixture
+def import_path(tmp_path, monkeypatch):
+	monkeypatch.syspath_prepend(str(tmp_path))
+	old_modules = sys.modules.copy()
+	try:
+		yield tmp_path
+	finally:
+		ie.uninstall()
+		sys.modules.clear()
+		sys.modules.update(old_modules)
+
+def test_import_hook_package(import_path, write_bytecode):
+	from import_expression._importer import ImportExpressionLoader
+
+	pkg = import_path / 'ie_test_pkg'
+	pkg.mkdir()
+	(pkg / '__init__.py').write_text('counter = collections!.Counter')
+	(pkg / 'sub.py').write_text('def quote(s): return urllib.parse!.quote(s)')
+	(import_path / 'ie_test_other.py').write_text('x = collections!.Counter')
+
+	finder = ie.install(['ie_test_pkg'])
+	import ie_test_pkg.sub
+	import collections
+	assert ie_test_pkg.counter is collections.Counter
+	assert ie_test_pkg.sub.quote('?') == '%3F'
+	assert isinstance(ie_test_pkg.sub.__loader__, ImportExpressionLoader)
+	assert os.path.exists(ie_test_pkg.sub.__cached__)
+
+	with pytest.raises(SyntaxError):
+		import ie_test_other
+
+	ie.uninstall(finder)
+	assert finder not in sys.meta_path
+
+def test_import_hook_marker(import_path):
+	(import_path / 'ie_test_marked.py').write_text('#!/usr/bin/env python3\n# -*- import-expression: on -*-\nx = collections!.Counter')
+	(import_path / 'ie_test_unmarked.py').write_text('x = 1')
+
+	ie.install(marker=True)
+	import ie_test_marked
+	import ie_test_unmarked
+	import collections
+	assert ie_test_marked.x is collections.Counter
+	assert type(ie_test_unmarked.__loader__) is importlib.machinery.SourceFileLoader
+
+@pytest.mark.usefixtures('engine')
+def test_multiline_token_after_import_expr():
+	import urllib.parse
+	assert ie.eval('urllib.parse!.quote("""?\n""").upper()') == '%3F%0A'
+
+@pytest.mark.usefixtures('engine')
+def test_many_import_exprs_on_one_line():
+	assert ie.eval(' + '.join(['len(collections!.Counter("ab"))'] * 100)) == 200
+
+@pytest.mark.parametrize('source', (
+	'x = (',
+	'"""',
+	'def foo():\nreturn 1',
+	'print("hi!", a!.b c)',
+	'x = 1 +\\\\',
+))
+def test_fast_path_errors(source):
+	"""errors must not depend on whether the source was first tried as regular Python"""
+	errors = []
+	for fast in (True, False):
+		with pytest.raises(SyntaxError) as excinfo:
+			ie._compile(source, 'test.py', 'exec', 0, True, -1, fast=fast)
+		errors.append((str(excinfo.value), excinfo.value.args))
+	assert errors[0] == errors[1]
+
+def test_fast_path(engine):
+	import collections
+	assert ie.eval('"hi!"') == 'hi!'
+	assert ie.eval('f"{1!r}"') == '1'
+	if engine == 'ast':
+		assert ie.eval('_IMPORT_MARKER(collections)') is collections
+	assert ie.find_imports('x = "a!.b"') == []
+	with pytest.raises(SyntaxError):
+		ie.find_imports('x = (')
+
+@pytest.mark.parametrize('source', ('.a!', 'not!', 'x.not!', 'True!', 'a!.b!'))
+def test_tokens_engine_invalid_names(source):
+	with pytest.raises(SyntaxError):
+		ie.compile(source, engine='tokens')
+
+def test_tokens_engine_source():
+	from import_expression._syntax import fix_syntax
+	assert (
+		fix_syntax('x = a.b!.c(d !, e!)', direct=True)
+		== 'x = __import__("importlib").import_module(\'a.b\').c(d !, __import__("importlib").import_module(\'e\'))'
+	)
+	# a space before the "!" is never allowed, whether or not the tokenizer returns it as a token
+	for engine in ('ast', 'tokens'):
+		with pytest.raises(SyntaxError):
+			ie.compile('x = (d !.e)', engine=engine)
+	assert ie.find_imports('x = (d !.e, f!)', engine='tokens') == ['f']
+
+def test_unknown_engine():
+	with pytest.raises(ValueError):
+		ie.compile('1', engine='nope')
+
+def test_find_imports():
+	assert ie.find_imports('x = a.b!.c + d!\ny = "e!.f"') == ['a.b', 'd']
+
+def test_cached_imports(monkeypatch):
+	import collections
+	import types
+	code = ie.compile('collections!.Counter', mode='eval', imports='cached')
+	assert ie.constants.IMPORT_HELPERS['cached'] in code.co_names
+	assert ie.eval(code) is collections.Counter
+
+	# sys.modules is checked every time
+	fake = types.SimpleNamespace(Counter=object())
+	monkeypatch.setitem(sys.modules, 'collections', fake)
+	assert ie.eval(code) is fake.Counter
+
+	# and modules that aren't imported yet are imported like usual
+	monkeypatch.delitem(sys.modules, 'colorsys', raising=False)
+	assert ie.eval(ie.compile('colorsys!.__name__', mode='eval', imports='cached')) == 'colorsys'
+
+	monkeypatch.setitem(sys.modules, 'collections', None)
+	with pytest.raises(ImportError):
+		ie.eval(code)
+
+def test_instrumented_imports(monkeypatch):
+	ie.import_stats_clear()
+	monkeypatch.delitem(sys.modules, 'colorsys', raising=False)
+	source = 'x = "é"; y = [os.path!.sep for _ in range(3)]\nz = (colorsys!, \\\n\tcolorsys!, 1)'
+	ie.exec(ie.compile(source, 'a.py', imports='instrumented'), {})
+	# the code is shared through the compile cache, but the filename is still reported correctly
+	ie.exec(ie.compile(source, 'b.py', imports='instrumented'), {})
+
+	stats = ie.import_stats()
+	assert list(stats) == ['a.py:1:15', 'a.py:2:6', 'a.py:3:2', 'b.py:1:15', 'b.py:2:6', 'b.py:3:2']
+	assert [(counters['hits'], counters['misses']) for modules in stats.values() for counters in modules.values()] == [
+		(3, 0), (0, 1), (1, 0), (3, 0), (1, 0), (1, 0),
+	]
+	assert all(modules.keys() == {'os.path'} for site, modules in stats.items() if ':1:' in site)
+	assert stats['a.py:1:15']['os.path']['calls'] == 3
+	assert stats['a.py:2:6']['colorsys']['miss_seconds'] > 0
+
+	metrics = ie.import_stats_openmetrics()
+	assert metrics.endswith('\n# EOF\n')
+	assert 'import_expression_imports_total{site="a.py:2:6",module="colorsys",result="miss"} 1\n' in metrics
+	assert '# TYPE import_expression_import_seconds counter\n' in metrics
+
+	ie.import_stats_clear()
+	assert ie.import_stats() == {}
+
+def test_unknown_imports():
+	with pytest.raises(ValueError):
+		ie.compile('a!', imports='nope')
+
+def test_lazy_imports(import_path, monkeypatch):
+	import types
+	pkg = import_path / 'ie_test_lazy_pkg'
+	pkg.mkdir()
+	(pkg / '__init__.py').write_text('import sys; sys.ie_test_lazy_loaded = ["pkg"]')
+	(pkg / 'mod.py').write_text('import sys; sys.ie_test_lazy_loaded.append("mod"); x = 1')
+	monkeypatch.setattr(sys, 'ie_test_lazy_loaded', [], raising=False)
+
+	code = ie.compile('ie_test_lazy_pkg.mod!', mode='eval', imports='lazy')
+	mod = ie.eval(code)
+	# the parent package is imported eagerly
+	assert sys.ie_test_lazy_loaded == ['pkg']
+	assert sys.modules['ie_test_lazy_pkg'].mod is mod
+	assert ie.eval(code) is mod
+
+	assert mod.x == 1
+	assert sys.ie_test_lazy_loaded == ['pkg', 'mod']
+	assert type(mod) is types.ModuleType
+
+	with pytest.raises(ModuleNotFoundError):
+		ie.eval(ie.compile('ie_test_lazy_pkg.nope!', mode='eval', imports='lazy'))
+
+def test_lazy_imports_eager_fallback(monkeypatch):
+	import importlib.util
+	import types
+	spec = importlib.util.find_spec('cmath')
+	if not isinstance(spec.loader, importlib.machinery.ExtensionFileLoader):
+		pytest.skip('cmath is not an extension module')
+	monkeypatch.delitem(sys.modules, 'cmath', raising=False)
+	cmath = ie.eval(ie.compile('cmath!', mode='eval', imports='lazy'))
+	assert type(cmath) is types.ModuleType
+	assert sys.modules['cmath'] is cmath
+
+def test_prefetch(import_path):
+	for name in 'ie_test_prefetch_a', 'ie_test_prefetch_b':
+		pkg = import_path / name
+		pkg.mkdir()
+		(pkg / '__init__.py').write_text('')
+		(pkg / 'mod.py').write_text('')
+	(import_path / 'ie_test_prefetch_broken.py').write_text('1 / 0')
+
+	results = ie.prefetch(
+		'ie_test_prefetch_a.mod!; ie_test_prefetch_b!; ie_test_prefetch_broken!; '
+		'ie_test_prefetch_missing!; ie_test_prefetch_a!; ie_test_prefetch_b!'
+	)
+	assert [result.module for result in results] == [
+		'ie_test_prefetch_a.mod', 'ie_test_prefetch_b', 'ie_test_prefetch_broken', 'ie_test_prefetch_missing',
+		'ie_test_prefetch_a',
+	]
+	assert all(result.seconds >= 0 for result in results)
+	assert 'ie_test_prefetch_a.mod' in sys.modules
+	assert 'ie_test_prefetch_b' in sys.modules
+	errors = {result.module: result.error for result in results}
+	assert isinstance(errors['ie_test_prefetch_broken'], ZeroDivisionError)
+	assert isinstance(errors['ie_test_prefetch_missing'], ModuleNotFoundError)
+	assert errors['ie_test_prefetch_a.mod'] is None
+
+	assert ie.prefetch('x = 1') == []
+
+def test_profile(engine):
+	calls = []
+	with ie.profile(lambda *args: calls.append(args)) as profile:
+		ie.compile('x = collections!.Counter', cache=False)
+		ie.compile('x = 1', cache=False)
+	ie.compile('y = collections!.Counter', cache=False)
+
+	expected = ['tokenize', 'transform_tokens', 'untokenize']
+	if engine == 'ast':
+		expected += ['parse', 'transform']
+	expected += ['compile', 'fast_path']
+	assert list(profile.stages) == expected
+	assert [stage for stage, seconds, peak in calls] == expected
+	assert all(stats.calls == 1 and stats.seconds >= 0 and stats.peak is None for stats in profile.stages.values())
+	assert profile.seconds == pytest.approx(sum(stats.seconds for stats in profile.stages.values()))
+
+def test_profile_memory():
+	import tracemalloc
+	with ie.profile(memory=True) as profile:
+		assert tracemalloc.is_tracing()
+		ie.parse('x = collections!.Counter')
+	assert not tracemalloc.is_tracing()
+	assert all(stats.peak > 0 for stats in profile.stages.values())
+
+def test_incremental_fixer():
+	from import_expression import _syntax
+
+	lines = textwrap.dedent("""
+		import sys
+		def f(x):
+			if x:
+				y = (os.path!.join(
+					'a', x!.b))
+				return collections!.Counter(y)
+			return [
+				json!.dumps(x)
+			]
+		z = 1 +\\
+			f(1)
+		class C:
+			'''a
+			b'''
+	""").replace('    ', '\t').split('\n')
+
+	for direct in False, True:
+		fixer = _syntax.IncrementalFixer()
+		for i in range(len(lines) + 1):
+			source = '\n'.join(lines[:i])
+			try:
+				expected = _syntax.fix_syntax(source, direct=direct)
+			except SyntaxError as exc:
+				with pytest.raises(SyntaxError) as excinfo:
+					fixer(source, direct=direct)
+				assert excinfo.value.args == exc.args
+			else:
+				assert fixer(source, direct=direct) == expected
+
+		# the source ends in a newline, so none of it needs to be tokenized again
+		assert fixer._source == source
+
+	# sources that don't extend the previous one start over
+	assert fixer('x!.y', direct=True) == _syntax.fix_syntax('x!.y', direct=True)
+
+def test_repl_incomplete_input():
+	from import_expression.__main__ import ImportExpressionCommandCompiler
+	compiler = ImportExpressionCommandCompiler()
+	assert compiler('x = (', '<console>', 'single') is None
+	assert compiler('x = (\n\tos!.sep,', '<console>', 'single') is None
+	assert compiler("x = '''", '<console>', 'single') is None
+	assert compiler('x = (\n\tos!.sep,\n)', '<console>', 'single') is not None
+	with pytest.raises(SyntaxError):
+		compiler('x = )', '<console>', 'single')
+
+def test_repl_completion(import_path, monkeypatch):
+	import threading
+	from import_expression.__main__ import ImportExpressionCompleter
+	(import_path / 'ie_test_complete_slow.py').write_text(
+		'import sys\nassert sys.ie_test_complete_event.wait(10)\nie_test_attr = 1'
+	)
+	event = threading.Event()
+	monkeypatch.setattr(sys, 'ie_test_complete_event', event, raising=False)
+
+	completer = ImportExpressionCompleter({}, timeout=0.01)
+	# the import doesn't block completion, and carries on in the background
+	assert completer.attr_matches('ie_test_complete_slow!.ie_test_') == []
+	assert completer.attr_matches('ie_test_complete_slow!.ie_test_') == []
+	event.set()
+	completer._imports['ie_test_complete_slow'].result(10)
+	assert completer.attr_matches('ie_test_complete_slow!.ie_test_') == ['ie_test_complete_slow!.ie_test_attr']
+
+	module = sys.modules['ie_test_complete_slow']
+	module.ie_test_other = 2
+	# cached
+	assert completer.attr_matches('ie_test_complete_slow!.ie_test_') == ['ie_test_complete_slow!.ie_test_attr']
+	# but not once sys.modules changes
+	monkeypatch.setitem(sys.modules, 'ie_test_complete_other', module)
+	assert completer.attr_matches('ie_test_complete_slow!.ie_test_') == [
+		'ie_test_complete_slow!.ie_test_attr', 'ie_test_complete_slow!.ie_test_other',
+	]
+	assert 'ie_test_complete_slow!' not in completer.namespace
+
+	assert completer.attr_matches('ie_test_complete_missing!.x') == []
+
+def test_startup_imports(tmp_path):
+	import subprocess
+	deferred = [
+		'asyncio', 'concurrent.futures', 'inspect', 'py_compile', 'rlcompleter', 'traceback', 'tracemalloc',
+		'import_expression._repl',
+	]
+	script = tmp_path / 'script.py'
+	script.write_text(f'import sys\nprint(*[name for name in {deferred!r} if name in sys.modules])')
+	for args in (
+		['-c', f'import import_expression; exec(open({str(script)!r}).read())'],
+		['-m', 'import_expression', str(script)],
+		['-c', f'import runpy, sys; sys.argv[1:] = ["--version"]\ntry: runpy.run_module("import_expression", run_name="__main__")\nexcept SystemExit: exec(open({str(script)!r}).read())'],
+	):
+		process = subprocess.run(
+			[sys.executable, *args],
+			cwd=os.path.dirname(os.path.abspath(__file__)),
+			capture_output=True,
+			check=True,
+			text=True,
+		)
+		# --version prints first
+		assert process.stdout.splitlines()[-1] == ''
+
+def test_aeval_aexec(import_path, monkeypatch):
+	import asyncio
+	import threading
+	(import_path / 'ie_test_aeval.py').write_text('import sys, threading\nthread = threading.current_thread()\nx = 1')
+	(import_path / 'ie_test_aeval_broken.py').write_text('1 / 0')
+
+	async def main():
+		assert await ie.aeval('ie_test_aeval!.x + y', dict(y=1)) == 2
+		# imported off the event loop's thread
+		assert sys.modules['ie_test_aeval'].thread is not threading.current_thread()
+
+		g = {}
+		assert await ie.aexec('z = ie_test_aeval!.x', g) is None
+		assert g['z'] == 1
+		assert await ie.aeval(ie.compile('ie_test_aeval!.x', mode='eval')) == 1
+
+		assert await ie.aeval('await asyncio.sleep(0, 3)', dict(asyncio=asyncio), top_level_await=True) == 3
+		coro = await ie.aeval('asyncio.sleep(0)', dict(asyncio=asyncio), top_level_await=True)
+		assert asyncio.iscoroutine(coro)
+		await coro
+		with pytest.raises(SyntaxError):
+			await ie.aeval('await asyncio.sleep(0)', dict(asyncio=asyncio))
+
+		with pytest.raises(ZeroDivisionError):
+			await ie.aexec('ie_test_aeval_broken!')
+
+	asyncio.run(main())
+
+def test_compile_function():
+	f = ie.compile_function('os.path!.basename(path) + suffix', 'path, suffix')
+	assert f('/a/b', '!') == 'b!'
+	assert f.__name__ == '<lambda>'
+	assert ie.compile_function('len(x)', 'x')('ab') == 2
+	g = {}
+	assert ie.compile_function('sorted(x)', 'x', globals=g)('ba') == ['a', 'b']
+	assert g['__builtins__'] is builtins
+
+	g = {'n': 1}
+	f = ie.compile_function('if x:\n\treturn collections!.Counter(x)\nglobal n\nn += 1', ['x'], mode='exec', globals=g)
+	assert f('aab') == {'a': 2, 'b': 1}
+	assert f('') is None
+	assert g['n'] == 2
+	assert ie.compile_function('', mode='exec')() is None
+
+	f = ie.compile_function('(\n\t1 /\n\tx)', 'x', 'f.py', name='divide')
+	with pytest.raises(ZeroDivisionError) as excinfo:
+		f(0)
+	assert excinfo.traceback[-1].frame.code.name == 'divide'
+	assert excinfo.traceback[-1].path == 'f.py'
+	assert excinfo.traceback[-1].lineno + 1 == 2
+
+	for argnames in ('x, x', 'class', ['1'], [1]):
+		with pytest.raises(ValueError):
+			ie.compile_function('x', argnames)
+	with pytest.raises(ValueError):
+		ie.compile_function('x', 'x', mode='single')
+	with pytest.raises(SyntaxError):
+		ie.compile_function('x = 1', 'x')
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_stream(workers):
+	import io
+	from import_expression import _stream
+
+	def run(expression, input, **kwargs):
+		output = io.StringIO()
+		_stream.run(expression, io.StringIO(input), output, batch_size=2, workers=workers, **kwargs)
+		return output.getvalue()
+
+	lines = ''.join(f'{{"id": {i}}}\n' for i in range(7))
+	assert run('json!.loads(line)["id"] * n', lines) == ''.join(f'{i * (i + 1)}\n' for i in range(7))
+	assert run('json!.loads(line)["id"] % 3 == 0', lines, filter=True) == '{"id": 0}\n{"id": 3}\n{"id": 6}\n'
+	assert run('line if n != 2 else None', 'a\nb\nc') == 'a\nc\n'
+	# builtins, including in worker processes
+	assert run('max(len(line), 2)', 'a\nbbb\n') == '2\n3\n'
+	assert run('len(line) + offset', 'a\0bb\0', separator='\0', begin='offset = 10') == '11\0' '12\0'
+	assert run('line', '') == ''
+
+	with pytest.raises(ZeroDivisionError):
+		run('1 / (n - 3)', lines)
+	with pytest.raises(SyntaxError):
+		run('x = ', lines)
+
+def test_stream_begin_end(capsys):
+	import io
+	from import_expression import _stream
+	_stream.run(
+		'seen.add(line)', io.StringIO('a\nb\na\n'), io.StringIO(),
+		begin='seen = set()', end='print(*sorted(seen)); print(collections!.Counter(seen)["a"])',
+	)
+	assert capsys.readouterr().out == 'a b\n1\n'
+
+def test_stream_cli(tmp_path):
+	import subprocess
+	path = tmp_path / 'input.txt'
+	path.write_text('1\n2\n3\n')
+	process = subprocess.run(
+		[sys.executable, '-m', 'import_expression', '--filter', '-e', 'int(line) % 2', str(path)],
+		cwd=os.path.dirname(os.path.abspath(__file__)),
+		capture_output=True,
+		check=True,
+		text=True,
+	)
+	assert process.stdout == '1\n3\n'
+
+def test_commands_cli(tmp_path):
+	import subprocess
+
+	def run(*args):
+		return subprocess.run(
+			[sys.executable, '-m', 'import_expression', *args],
+			cwd=tmp_path,
+			env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__))),
+			capture_output=True,
+			check=True,
+			text=True,
+		).stdout
+
+	(tmp_path / 'a.py').write_text('x = collections!.Counter\n')
+	help = run('--help')
+	assert 'compileall' in help and 'scan' in help
+	assert run('-m', 'compileall', 'a.py').endswith('1 compiled, 0 up to date, 0 failed\n')
+	assert os.path.exists(importlib.util.cache_from_source(str(tmp_path / 'a.py')))
+	assert run('-m', 'scan', 'a.py') == 'collections\ta.py:1:5\n'
+	# commands can't be mistaken for files to run
+	for command in ('compileall', 'scan'):
+		(tmp_path / command).write_text('print(os!.sep)')
+		assert run(command) == os.sep + '\n'